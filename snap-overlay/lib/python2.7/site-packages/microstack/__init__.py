@@ -0,0 +1 @@
+# Helpers for the microstack commands in $SNAP/bin.
@@ -0,0 +1,161 @@
+"""Bring up the OpenStack services as a dependency graph.
+
+Each stage in the graph (see etc/microstack/bringup.yaml) runs some
+commands, restarts the units it names and waits for the services it
+names to be ready. A stage starts as soon as the stages it comes after
+have finished, so that independent work, such as the nova, neutron and
+glance schema migrations, runs concurrently.
+
+Stage timings and the critical path through the graph are printed at
+the end.
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+import time
+from concurrent import futures
+
+import yaml
+
+from microstack import timing
+
+
+class StageFailed(Exception):
+    pass
+
+
+class Stage(object):
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.after = spec.get('after', [])
+        self.run = spec.get('run', [])
+        self.restart = spec.get('restart', [])
+        self.ready = spec.get('ready', [])
+        self.start = self.end = None
+
+    def commands(self):
+        commands = list(self.run)
+        if self.restart:
+            commands.append('systemctl restart ' + ' '.join(
+                'snap.microstack.{}'.format(unit) for unit in self.restart))
+        if self.ready:
+            commands.append('wait-ready ' + ' '.join(self.ready))
+        return commands
+
+    def execute(self):
+        """Run the stage's commands, returning their combined output."""
+        output = []
+        for command in self.commands():
+            proc = subprocess.Popen(
+                ['bash', '-ec', command], stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True)
+            out, _ = proc.communicate()
+            output.append('+ {}\n{}'.format(command, out))
+            if proc.returncode:
+                raise StageFailed(''.join(output))
+        return ''.join(output)
+
+
+def load(path):
+    with open(path) as graph:
+        stages = dict((name, Stage(name, spec))
+                      for name, spec in yaml.safe_load(graph).items())
+    for stage in stages.values():
+        for dep in stage.after:
+            if dep not in stages:
+                raise ValueError('{} comes after unknown stage {}'.format(
+                    stage.name, dep))
+    # Kahn's algorithm; anything left over is part of a cycle.
+    placed = set()
+    while len(placed) < len(stages):
+        free = [s.name for s in stages.values() if s.name not in placed and
+                all(d in placed for d in s.after)]
+        if not free:
+            raise ValueError('cycle between stages {}'.format(
+                ', '.join(sorted(set(stages) - placed))))
+        placed.update(free)
+    return stages
+
+
+def critical_path(stages):
+    """The chain of stages that ended last, each waiting on the previous."""
+    finished = [s for s in stages.values() if s.end is not None]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda s: s.end)]
+    while path[-1].after:
+        path.append(max((stages[d] for d in path[-1].after),
+                        key=lambda s: s.end))
+    return list(reversed(path))
+
+
+def schedule(stages, timeline, out=sys.stdout):
+    """Run every stage once its dependencies are done.
+
+    Once a stage fails no new stages are started; the ones already
+    running are left to finish. Returns the names of failed stages.
+    """
+    pending = dict(stages)
+    running = {}
+    done = set()
+    failed = []
+    pool = futures.ThreadPoolExecutor(max_workers=len(stages) or 1)
+
+    def run(stage):
+        stage.start = time.time()
+        try:
+            with timeline.span(stage.name, 'stage'):
+                return stage.execute()
+        finally:
+            stage.end = time.time()
+
+    while pending or running:
+        if not failed:
+            for name, stage in sorted(pending.items()):
+                if all(dep in done for dep in stage.after):
+                    print('Starting {}'.format(name), file=out)
+                    running[pool.submit(run, stage)] = stage
+                    del pending[name]
+        if not running:
+            break
+        finished, _ = futures.wait(
+            running, return_when=futures.FIRST_COMPLETED)
+        for job in finished:
+            stage = running.pop(job)
+            try:
+                output = job.result()
+            except StageFailed as e:
+                failed.append(stage.name)
+                print('{} failed:\n{}'.format(stage.name, e), file=out)
+                continue
+            done.add(stage.name)
+            print('Finished {} in {:.2f}s\n{}'.format(
+                stage.name, stage.end - stage.start, output), file=out)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the stages of a bring-up graph concurrently.')
+    parser.add_argument('graph', help='path to the bring-up graph yaml file')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the stage timeline to FILE')
+    args = parser.parse_args()
+
+    stages = load(args.graph)
+    timeline = timing.Timeline()
+    failed = schedule(stages, timeline)
+
+    timeline.report()
+    path = critical_path(stages)
+    print('Critical path: ' + ' -> '.join(
+        '{} ({:.2f}s)'.format(s.name, s.end - s.start) for s in path))
+    if args.json:
+        timeline.dump(args.json)
+    if failed:
+        print('Failed stages: ' + ', '.join(failed), file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,117 @@
+"""Look at, and flush, the memcached the services share.
+
+Keystone caches token validation, catalog, role and assignment lookups
+in memcached, and the keystonemiddleware in front of Nova, Neutron and
+Glance caches validated tokens there, so that an API call doesn't
+cost a round trip to Keystone. Both are switched on and off with
+"snap set microstack cache=true|false".
+
+"stats" makes a number of API calls with one token, and reports the
+memcached hit rate over those calls, and how many token validations
+Keystone served per call (counted from the nginx access log).
+"""
+from __future__ import print_function
+
+import argparse
+import errno
+import os
+import socket
+
+from microstack import cloud
+from microstack import config
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+ACCESS_LOG = os.path.join(SNAP_COMMON, 'log/nginx-access.log')
+PORT = 11211
+
+# Cheap calls that each go through keystonemiddleware.
+CALLS = [
+    ('compute', '/flavors'),
+    ('network', '/v2.0/networks'),
+    ('image', '/v2/images'),
+]
+
+
+def _command(host, command, end):
+    sock = socket.create_connection((host, PORT), timeout=5)
+    try:
+        sock.sendall(command + b'\r\n')
+        reply = b''
+        while not reply.endswith(end):
+            data = sock.recv(4096)
+            if not data:
+                break
+            reply += data
+        return reply.decode()
+    finally:
+        sock.close()
+
+
+def stats(host):
+    """Return memcached's counters, as ints where they are numbers."""
+    counters = {}
+    for line in _command(host, b'stats', b'END\r\n').splitlines():
+        if line.startswith('STAT '):
+            _, name, value = line.split(' ', 2)
+            counters[name] = int(value) if value.isdigit() else value
+    return counters
+
+
+def flush(host):
+    """Drop everything, e.g. after the catalog is changed in the db."""
+    if _command(host, b'flush_all', b'\r\n').strip() != 'OK':
+        raise RuntimeError('memcached on {} did not flush'.format(host))
+
+
+def validations(offset=0):
+    """Count the token validations in the access log after offset."""
+    with open(ACCESS_LOG) as log:
+        log.seek(offset)
+        return sum(1 for line in log if '"GET /v3/auth/tokens' in line)
+
+
+def measure(host, calls):
+    sess = cloud.session_from_env()
+    apis = dict((kind, cloud.service(sess, kind)) for kind, _ in CALLS)
+    sess.get_token()  # Not counted: issuing isn't validating.
+
+    before = stats(host)
+    offset = os.path.getsize(ACCESS_LOG)
+    for i in range(calls):
+        kind, path = CALLS[i % len(CALLS)]
+        apis[kind].get(path)
+    count = validations(offset)
+    after = stats(host)
+
+    hits = after['get_hits'] - before['get_hits']
+    misses = after['get_misses'] - before['get_misses']
+    print('{} API calls, {} token validations by keystone ({:.2f} per call)'
+          .format(calls, count, float(count) / calls))
+    print('memcached: {} hits, {} misses, hit rate {:.0%}'.format(
+        hits, misses, float(hits) / (hits + misses) if hits + misses else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure or flush the memcached the services use.')
+    parser.add_argument('action', nargs='?', default='stats',
+                        choices=['stats', 'flush'])
+    parser.add_argument('--host', default=config.get('extgateway',
+                                                     '10.20.20.1'))
+    parser.add_argument('--calls', type=int, default=30,
+                        help='API calls to make when measuring')
+    args = parser.parse_args()
+
+    if args.action == 'flush':
+        try:
+            flush(args.host)
+        except socket.error as e:
+            if e.errno != errno.ECONNREFUSED:
+                raise
+            # Not running yet, so there's nothing cached.
+        return 0
+
+    enabled = str(config.get('cache', True)).lower() != 'false'
+    print('caching is {}'.format('on' if enabled else 'off'))
+    measure(args.host, args.calls)
+    return 0
@@ -0,0 +1,233 @@
+"""Restart or reload only the units whose configuration changed.
+
+"snap-openstack setup" renders the templates in snap-openstack.yaml's
+setup section on each "snap set". After it has, "apply" (run by the
+configure hook) hashes each rendered file, compares the hashes with
+those recorded the last time, and restarts or reloads the units that
+read the files that changed, as etc/microstack/consumers.yaml lists
+them. Units that aren't running are left alone. Then it records the new
+hashes.
+
+The templates of the entry points (the uwsgi apps' ini files) are only
+rendered by "snap-openstack launch", as their unit starts, so what is
+on disk is from the last start. "apply" renders those itself, with the
+snap config, and hashes that; the units have to be restarted for them
+to be rendered again.
+
+"show" (the default) is a dry run: given snap config as key=value, it
+renders the templates with and without it and shows what a "snap set"
+of it would restart, together with anything rendered but not yet
+applied.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+
+import jinja2
+import yaml
+
+from microstack import config
+from microstack import logs
+from microstack import sizing
+
+SNAP = os.environ.get('SNAP', '/snap/microstack/current')
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+SNAP_OPENSTACK = os.path.join(SNAP, 'snap-openstack.yaml')
+CONSUMERS = os.path.join(SNAP, 'etc/microstack/consumers.yaml')
+RECORD = os.path.join(SNAP_COMMON, 'etc/microstack/rendered.json')
+
+
+def templates():
+    """Return the file each template in snap-openstack.yaml renders to."""
+    with open(SNAP_OPENSTACK) as f:
+        spec = yaml.safe_load(f)
+    found = dict(spec['setup'].get('templates', {}))
+    for entry_point in spec.get('entry_points', {}).values():
+        found.update(entry_point.get('templates', {}))
+    return dict((template, path.format(snap=SNAP, snap_common=SNAP_COMMON))
+                for template, path in found.items())
+
+
+def launched():
+    """Return the templates that only snap-openstack launch renders."""
+    with open(SNAP_OPENSTACK) as f:
+        spec = yaml.safe_load(f)
+    return set(template
+               for entry_point in spec.get('entry_points', {}).values()
+               for template in entry_point.get('templates', {}))
+
+
+def config_keys():
+    with open(SNAP_OPENSTACK) as f:
+        return yaml.safe_load(f)['setup'].get('snap-config-keys', [])
+
+
+def consumers():
+    with open(CONSUMERS) as f:
+        return yaml.safe_load(f)
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def rendered(outputs):
+    """Return the hash of each rendered file, or None if it is missing."""
+    hashes = {}
+    for template, path in outputs.items():
+        try:
+            with open(path, 'rb') as f:
+                hashes[template] = digest(f.read())
+        except IOError:
+            hashes[template] = None
+    return hashes
+
+
+def recorded():
+    try:
+        with open(RECORD) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def record(hashes):
+    with open(RECORD + '.new', 'w') as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    os.rename(RECORD + '.new', RECORD)
+
+
+def context(overrides=None):
+    """Return what snap-openstack renders the templates with.
+
+    overrides are snap config keys as "snap set" takes them; the sizing
+    and the log levels are worked out again if they change them.
+    """
+    values = dict((key, config.get(key)) for key in config_keys())
+    overrides = dict(overrides or {})
+    if any(key == 'workerprofile' or key.startswith('workers.')
+           for key in overrides):
+        cpus, memory_mb = sizing.hardware()
+        workers = config.get('workers', {})
+        workers.update((key.split('.', 1)[1], int(value))
+                       for key, value in overrides.items()
+                       if key.startswith('workers.'))
+        workers, threads = sizing.size(
+            cpus, memory_mb,
+            overrides.get('workerprofile', config.get('workerprofile',
+                                                      'auto')),
+            workers)
+        values.update(sizing.snap_keys(workers, threads, memory_mb,
+                                       sizing.somaxconn()))
+    if any(key.startswith('loglevel.') for key in overrides):
+        service_levels = config.get('loglevel', {})
+        service_levels.update((key.split('.', 1)[1], value)
+                              for key, value in overrides.items()
+                              if key.startswith('loglevel.'))
+        values.update(logs.snap_keys(logs.levels(service_levels)))
+    values.update(overrides)
+    values.update(snap=SNAP, snap_common=SNAP_COMMON)
+    return values
+
+
+def render(names, values):
+    """Return the hash of each template rendered with values."""
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(os.path.join(SNAP, 'templates')))
+    return dict((name, digest(env.get_template(name).render(
+        **values).encode('utf-8'))) for name in names)
+
+
+def plan(changed, units_of):
+    """Return the templates behind each unit to restart, and to reload."""
+    restart, reload = {}, {}
+    for template in sorted(changed):
+        units = units_of.get(template) or {}
+        for unit in units.get('restart', []):
+            restart.setdefault(unit, []).append(template)
+        for unit in units.get('reload', []):
+            reload.setdefault(unit, []).append(template)
+    # A restart takes a reload's changes too.
+    for unit in restart:
+        restart[unit].extend(reload.pop(unit, []))
+    return restart, reload
+
+
+def active(unit):
+    return subprocess.call(
+        ['systemctl', 'is-active', '--quiet',
+         'snap.microstack.{}'.format(unit)]) == 0
+
+
+def act(restart, reload):
+    for unit in sorted(restart):
+        if active(unit):
+            print('Restarting {} ({})'.format(unit, ', '.join(restart[unit])))
+            subprocess.check_call(['systemctl', 'restart',
+                                   'snap.microstack.{}'.format(unit)])
+    for unit in sorted(reload):
+        if active(unit):
+            print('Reloading {} ({})'.format(unit, ', '.join(reload[unit])))
+            subprocess.check_call(['systemctl', 'kill', '--kill-who=main',
+                                   '--signal=HUP',
+                                   'snap.microstack.{}'.format(unit)])
+
+
+def show(restart, reload, unmapped):
+    if not restart and not reload:
+        print('Nothing to restart or reload.')
+    for unit in sorted(restart):
+        print('restart {}{}: {}'.format(
+            unit, '' if active(unit) else ' (not running)',
+            ', '.join(restart[unit])))
+    for unit in sorted(reload):
+        print('reload {}{}: {}'.format(
+            unit, '' if active(unit) else ' (not running)',
+            ', '.join(reload[unit])))
+    for template in sorted(unmapped):
+        print('{} changes, but consumers.yaml does not say what reads '
+              'it'.format(template))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Restart or reload the units whose rendered '
+                    'configuration changed.')
+    parser.add_argument('action', nargs='?', default='show',
+                        choices=['show', 'apply'],
+                        help='show what would restart (default), or '
+                             'restart it and record the rendered files '
+                             '(hooks only)')
+    parser.add_argument('settings', nargs='*', metavar='KEY=VALUE',
+                        help='snap config to show the effect of')
+    args = parser.parse_args()
+
+    outputs = templates()
+    units_of = consumers()
+    before = recorded()
+    at_launch = launched()
+    now = rendered(dict((t, p) for t, p in outputs.items()
+                        if t not in at_launch))
+    now.update(render(at_launch, context()))
+    changed = set(t for t in outputs if now[t] != before.get(t))
+
+    if args.action == 'apply':
+        act(*plan(changed, units_of))
+        record(now)
+        return 0
+
+    if args.settings:
+        try:
+            overrides = dict(s.split('=', 1) for s in args.settings)
+        except ValueError:
+            parser.error('settings are KEY=VALUE')
+        current = render(outputs, context())
+        proposed = render(outputs, context(overrides))
+        changed.update(t for t in outputs if current[t] != proposed[t])
+    restart, reload = plan(changed, units_of)
+    show(restart, reload, changed - set(units_of))
+    return 0
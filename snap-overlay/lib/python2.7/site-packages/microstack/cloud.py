@@ -0,0 +1,66 @@
+"""Authenticated access to the local cloud.
+
+The microstack commands talk to the OpenStack APIs directly over one
+keystoneauth session, rather than running the openstack CLI once per
+call, which pays for a fresh interpreter, a fresh token and a fresh
+catalog every time.
+"""
+import os
+
+from keystoneauth1 import adapter
+from keystoneauth1 import session
+from keystoneauth1.identity import generic
+
+REGION = 'microstack'
+
+
+def session_from_env(environ=os.environ):
+    """Build a session from the OS_* variables set by microstack.rc."""
+    auth = generic.Password(
+        auth_url=environ['OS_AUTH_URL'],
+        username=environ['OS_USERNAME'],
+        password=environ['OS_PASSWORD'],
+        project_name=environ['OS_PROJECT_NAME'],
+        user_domain_name=environ.get('OS_USER_DOMAIN_NAME', 'default'),
+        project_domain_name=environ.get('OS_PROJECT_DOMAIN_NAME', 'default'))
+    return session.Session(auth=auth)
+
+
+def service(sess, service_type, region_name=REGION, interface='public'):
+    """Return an adapter for one service in the catalog."""
+    return adapter.Adapter(
+        sess, service_type=service_type, interface=interface,
+        region_name=region_name)
+
+
+def allow_ping_and_ssh(neutron, project_id):
+    """Allow ping and ssh in the project's default security group.
+
+    Returns what it had to allow, of "ping" and "ssh".
+    """
+    group = neutron.get(
+        '/v2.0/security-groups?name=default&project_id={}'.format(
+            project_id)).json()['security_groups'][0]['id']
+    rules = neutron.get(
+        '/v2.0/security-group-rules?direction=ingress&'
+        'security_group_id=' + group).json()['security_group_rules']
+    created = []
+    if 'icmp' not in set(r['protocol'] for r in rules):
+        neutron.post('/v2.0/security-group-rules', json={
+            'security_group_rule': {
+                'security_group_id': group,
+                'direction': 'ingress',
+                'protocol': 'icmp'}})
+        created.append('ping')
+    if not [r for r in rules if r['protocol'] == 'tcp' and
+            (r['port_range_min'] or 0) <= 22 <=
+            (r['port_range_max'] or 65535)]:
+        neutron.post('/v2.0/security-group-rules', json={
+            'security_group_rule': {
+                'security_group_id': group,
+                'direction': 'ingress',
+                'protocol': 'tcp',
+                'port_range_min': 22,
+                'port_range_max': 22}})
+        created.append('ssh')
+    return created
@@ -0,0 +1,199 @@
+"""Add compute nodes to a microstack control plane.
+
+On the controller, "microstack.add-compute" prints a token. On a new
+node with microstack installed, "microstack.join <token>" makes it a
+compute node: it sets "role=compute", which keeps the control plane's
+daemons from running there (see bin/role), stops them, and points
+nova-compute and the openvswitch agent at the controller.
+
+The services on the controller listen on extgateway, the address of its
+br-ex, which is what the catalog, the transport_urls and the templates
+use. A compute node keeps the same extgateway, and routes it through
+the controller's own address (controlip, see bin/setup-br-ex), so
+nothing rendered differs between the nodes but the tunnel address:
+each node's openvswitch agent tunnels from localip, its own address
+towards the others, which add-compute sets on the controller too.
+
+The token isn't a credential of its own: it carries the controller's
+addresses and the admin password, for microstack.openstack on the
+node, so it should be handled like the password. Compute nodes need
+networkbackend=ovs, the default; OVN's southbound database only
+listens on a unix socket. Once it has printed the token, add-compute
+waits for the new node's nova-compute to register, and maps its host
+into the cell at once (see microstack/hostmap.py); otherwise
+nova-scheduler would only within discover_hosts_in_cells_interval
+(five minutes).
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import socket
+import subprocess
+import sys
+import time
+
+from microstack import config
+from microstack import hostmap
+
+# The daemons that a compute node runs. Every other one is wrapped
+# with "role control" in snapcraft.yaml.
+COMPUTE = ['nova-compute', 'libvirtd', 'virtlogd',
+           'neutron-openvswitch-agent', 'ovsdb-server', 'ovs-vswitchd',
+           'external-bridge', 'logrotate']
+
+# What a token carries: snap config keys, set as they are on the node.
+TOKEN_KEYS = ['controlip', 'extgateway', 'ospassword', 'networkbackend']
+
+# How long join waits for keystone on the controller.
+TIMEOUT = 60
+
+
+def address(towards='1.1.1.1'):
+    """Return the address this host reaches towards from."""
+    out = subprocess.check_output(['ip', '-o', 'route', 'get', towards],
+                                  universal_newlines=True)
+    words = out.split()
+    return words[words.index('src') + 1]
+
+
+def encode(values):
+    return base64.urlsafe_b64encode(
+        json.dumps(values, sort_keys=True).encode()).decode()
+
+
+def decode(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            token.strip().encode()).decode())
+    except (TypeError, ValueError):
+        values = None
+    if not isinstance(values, dict):
+        raise ValueError('not a microstack join token')
+    missing = [key for key in TOKEN_KEYS if not values.get(key)]
+    if missing:
+        raise ValueError('the token has no {}'.format(', '.join(missing)))
+    return values
+
+
+def render():
+    """Render the templates, and restart the daemons whose config changed."""
+    subprocess.check_call(['snap-openstack', 'setup'])
+    subprocess.check_call(['config-changes', 'apply'])
+
+
+def units():
+    """Return the snap's daemons that are running."""
+    out = subprocess.check_output(
+        ['systemctl', 'list-units', '--plain', '--no-legend',
+         '--state=active', 'snap.microstack.*'], universal_newlines=True)
+    return [line.split()[0][len('snap.microstack.'):].rsplit('.', 1)[0]
+            for line in out.splitlines() if line.strip()]
+
+
+def reachable(host, port, deadline):
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=5).close()
+            return True
+        except (socket.error, socket.timeout):
+            if time.time() > deadline:
+                return False
+            time.sleep(2)
+
+
+def add_compute(controlip):
+    if config.get('role', 'control') != 'control':
+        print('This is a compute node; run add-compute on the controller.',
+              file=sys.stderr)
+        return 1
+    if config.get('networkbackend', 'ovs') != 'ovs':
+        print('Compute nodes need networkbackend=ovs.', file=sys.stderr)
+        return 1
+    controlip = controlip or address()
+    # Tunnels to the compute nodes start from here.
+    if config.get('localip') != controlip:
+        config.set({'localip': controlip})
+        render()
+    values = dict((key, config.get(key)) for key in TOKEN_KEYS)
+    values.update(controlip=controlip,
+                  networkbackend=values['networkbackend'] or 'ovs')
+    print('On the new node, with microstack installed, run:')
+    print()
+    print('    sudo microstack.join {}'.format(encode(values)))
+    print()
+    print('The token carries the admin password. For more than one '
+          'host, consider "snap set microstack schedulerprofile=general".')
+    print()
+    print('Waiting for the node to join, to map it into the cell '
+          '(Ctrl-C to stop; nova-scheduler maps it within five minutes).')
+    sys.stdout.flush()
+    try:
+        # This host's own is map-host's to map.
+        hosts = hostmap.map_new(time.time() + hostmap.TIMEOUT,
+                                ignore=(socket.gethostname(),))
+    except KeyboardInterrupt:
+        return 0
+    if not hosts:
+        print('No node joined in {} seconds.'.format(hostmap.TIMEOUT))
+        return 0
+    for host in hosts:
+        print('Mapped {}.'.format(host))
+    return 0
+
+
+def join(token):
+    try:
+        values = decode(token)
+    except ValueError as e:
+        print('Cannot join: {}'.format(e), file=sys.stderr)
+        return 1
+    if values['networkbackend'] != 'ovs':
+        print('Cannot join: compute nodes need networkbackend=ovs on the '
+              'controller.', file=sys.stderr)
+        return 1
+
+    localip = address(values['controlip'])
+    print('Joining {} as a compute node, tunnelling from {}'.format(
+        values['controlip'], localip))
+    values.update(role='compute', localip=localip)
+    config.set(values)
+
+    for unit in sorted(set(units()) - set(COMPUTE)):
+        print('Stopping {}'.format(unit))
+        subprocess.call(['systemctl', 'stop',
+                         'snap.microstack.{}'.format(unit)])
+    # Route extgateway through the controller.
+    subprocess.check_call(['systemctl', 'restart',
+                           'snap.microstack.external-bridge'])
+    if not reachable(values['extgateway'], 5000, time.time() + TIMEOUT):
+        print('Cannot reach keystone at {} through {}.'.format(
+            values['extgateway'], values['controlip']), file=sys.stderr)
+        return 1
+    render()
+    print('Joined. add-compute, if it is still waiting, maps this host '
+          'as soon as nova-compute registers; see "microstack.nova-manage '
+          'cell_v2 list_hosts" on the controller.')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add compute nodes to a microstack control plane.')
+    subparsers = parser.add_subparsers(dest='action')
+    add_parser = subparsers.add_parser(
+        'add-compute', help='print a token for a new compute node to join '
+                            'with (on the controller)')
+    add_parser.add_argument('--address', help='the controller\'s address, '
+                            'as the compute nodes reach it (default: that '
+                            'of the default route)')
+    join_parser = subparsers.add_parser(
+        'join', help='make this node a compute node of the controller that '
+                     'printed the token')
+    join_parser.add_argument('token')
+    args = parser.parse_args()
+
+    if args.action == 'add-compute':
+        return add_compute(args.address)
+    return join(args.token)
@@ -0,0 +1,19 @@
+"""Read and write the snap's configuration with snapctl."""
+import json
+import subprocess
+
+
+def get(key, default=None):
+    """Return the value of key, or default if it isn't set."""
+    try:
+        out = subprocess.check_output(['snapctl', 'get', '-d', key])
+    except (OSError, subprocess.CalledProcessError):
+        return default
+    value = json.loads(out.decode()).get(key)
+    return default if value in (None, '') else value
+
+
+def set(values):
+    """Set several keys at once. Only works from hooks, or as root."""
+    subprocess.check_call(['snapctl', 'set'] + [
+        '{}={}'.format(key, value) for key, value in sorted(values.items())])
@@ -0,0 +1,94 @@
+"""Report the database connections each service holds.
+
+The services connect to MySQL through its unix socket (or over TCP to
+extgateway, with "snap set microstack dbsocket=false"), each process
+keeping a pool sized by service-sizing: <project>dbpool connections
+kept open, and up to <project>dboverflow more when busy. This counts
+the connections of each database user in MySQL's process list, and
+shows them against what the pools allow, and against max_connections.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+
+import pymysql
+
+from microstack import config
+from microstack import sizing
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+MYSQL_SOCKET = os.path.join(SNAP_COMMON, 'run/mysql/mysqld.sock')
+
+# Database user: the project whose pools it is in.
+USERS = {
+    'keystone': 'keystone',
+    'nova': 'nova',
+    'nova_api': 'nova',
+    'neutron': 'neutron',
+    'glance': 'glance',
+    'cinder': 'cinder',
+}
+
+
+def processes():
+    """Return how many processes of each project keep database pools."""
+    counts = {}
+    for project, (services, extra, engines) in sizing.DB_PROCESSES.items():
+        workers = sum(int(config.get('{}workers'.format(s), 1))
+                      for s in services)
+        counts[project] = (workers + extra) * engines
+    counts['glance'] = sizing.hardware()[0]
+    return counts
+
+
+def usage(cursor):
+    """Return the connections, busy ones, and sockets of each project."""
+    found = collections.defaultdict(lambda: [0, 0, 0])
+    cursor.execute('SELECT user, host, command '
+                   'FROM information_schema.processlist')
+    for user, host, command in cursor.fetchall():
+        project = USERS.get(user, user)
+        found[project][0] += 1
+        if command != 'Sleep':
+            found[project][1] += 1
+        if host == 'localhost':
+            found[project][2] += 1
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Show the database connections of each service.')
+    parser.parse_args()
+
+    conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                           connect_timeout=5)
+    try:
+        with conn.cursor() as cursor:
+            found = usage(cursor)
+            cursor.execute("SHOW GLOBAL VARIABLES LIKE 'max_connections'")
+            max_connections = int(cursor.fetchone()[1])
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Max_used_connections'")
+            max_used = int(cursor.fetchone()[1])
+    finally:
+        conn.close()
+
+    counts = processes()
+    print('{:<10} {:>11} {:>5} {:>7} {:>9} {:>6}'.format(
+        'service', 'connections', 'busy', 'socket', 'processes', 'limit'))
+    for project in sorted(set(found) | set(counts)):
+        connections, busy, sockets = found[project]
+        limit = '-'
+        if project in counts:
+            pool = int(config.get('{}dbpool'.format(project), 5))
+            overflow = int(config.get('{}dboverflow'.format(project), 10))
+            limit = counts[project] * (pool + overflow)
+        print('{:<10} {:>11} {:>5} {:>7} {:>9} {:>6}'.format(
+            project, connections, busy, sockets,
+            counts.get(project, '-'), limit))
+    print('{} connections of max_connections {}, at most {} since mysqld '
+          'started'.format(sum(f[0] for f in found.values()),
+                           max_connections, max_used))
+    return 0
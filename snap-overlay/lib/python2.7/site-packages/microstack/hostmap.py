@@ -0,0 +1,134 @@
+"""Map nova-compute's host into its cell as soon as it registers.
+
+Nova only schedules to hosts that are mapped to a cell, and maps new
+ones in the scheduler's periodic discovery, so on a fresh install the
+first boots could wait for the next sweep, or fail. map-host runs in
+front of nova-compute: it forks a watcher and execs the daemon. The
+watcher waits for the host's compute node to turn up in the cell
+database, and runs "nova-manage cell_v2 discover_hosts" for it there
+and then.
+
+The host is nova's default, the hostname. A compute node (see
+microstack/cluster.py) has no database: "microstack.add-compute", on
+the controller, waits for the node's compute node to turn up unmapped,
+and maps it the same way.
+"""
+from __future__ import print_function
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pymysql
+
+from microstack import config
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+MYSQL_SOCKET = os.path.join(SNAP_COMMON, 'run/mysql/mysqld.sock')
+CELL_DATABASE = 'nova'
+
+# Seconds between looks at the database, and how long to keep looking.
+INTERVAL = 1
+TIMEOUT = 600
+
+
+def mapped(cursor, host):
+    """Whether host's compute node is mapped; None until it registers."""
+    cursor.execute(
+        'SELECT mapped FROM {}.compute_nodes '
+        'WHERE host = %s AND deleted = 0'.format(CELL_DATABASE), (host,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return all(row[0] for row in rows)
+
+
+def unmapped(cursor):
+    """Return the hosts of the compute nodes not mapped yet."""
+    cursor.execute(
+        'SELECT DISTINCT host FROM {}.compute_nodes '
+        'WHERE mapped = 0 AND deleted = 0'.format(CELL_DATABASE))
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def discover():
+    subprocess.check_call(['snap-openstack', 'nova-manage', 'cell_v2',
+                           'discover_hosts'])
+
+
+def wait_and_map(host, deadline):
+    while time.time() < deadline:
+        try:
+            conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                                   connect_timeout=5, autocommit=True)
+            try:
+                with conn.cursor() as cursor:
+                    state = mapped(cursor, host)
+                    if state is False:
+                        discover()
+                        state = mapped(cursor, host)
+            finally:
+                conn.close()
+            if state:
+                return
+        except (pymysql.MySQLError, subprocess.CalledProcessError):
+            pass
+        time.sleep(INTERVAL)
+
+
+def map_new(deadline, ignore=()):
+    """Wait for compute nodes to register unmapped, and map them.
+
+    Returns their hosts, or [] if none but those in ignore turned up by
+    deadline.
+    """
+    while time.time() < deadline:
+        hosts = []
+        try:
+            conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                                   connect_timeout=5, autocommit=True)
+            try:
+                with conn.cursor() as cursor:
+                    hosts = [host for host in unmapped(cursor)
+                             if host not in ignore]
+                    if hosts:
+                        discover()
+            finally:
+                conn.close()
+            if hosts:
+                return hosts
+        except (pymysql.MySQLError, subprocess.CalledProcessError):
+            pass
+        time.sleep(INTERVAL)
+    return []
+
+
+def launch(argv):
+    """Fork the watcher and exec argv.
+
+    Mapping must never keep nova-compute from starting, so any error in
+    it is ignored.
+    """
+    if config.get('role', 'control') == 'compute':
+        os.execvp(argv[0], argv)
+    try:
+        child = os.fork()
+        if child == 0:
+            # Detach, so that the daemon doesn't have a child to reap.
+            os.setsid()
+            if os.fork() == 0:
+                try:
+                    devnull = os.open(os.devnull, os.O_RDWR)
+                    for fd in (0, 1, 2):
+                        os.dup2(devnull, fd)
+                    wait_and_map(socket.gethostname(),
+                                 time.time() + TIMEOUT)
+                finally:
+                    os._exit(0)
+            os._exit(0)
+        os.waitpid(child, 0)
+    except Exception as e:
+        print('Not mapping the host: {}'.format(e), file=sys.stderr)
+    os.execvp(argv[0], argv)
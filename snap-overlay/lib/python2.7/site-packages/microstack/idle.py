@@ -0,0 +1,306 @@
+"""Stretch the services' periodic intervals while the cloud is idle.
+
+Even with nothing to do, nova-compute's resource tracker and periodic
+tasks, the services' state reports, the neutron agents' polling and
+the RabbitMQ heartbeats keep waking up. With "snap set microstack
+idlemode=auto", the idle-watch daemon looks for activity every
+INTERVAL seconds:
+
+- tokens issued to anyone but the services themselves, which every
+  openstack command and microstack.launch asks for, and requests to
+  the dashboard, from nginx's access log;
+- changes to instances, ports, networks and images, from the
+  databases.
+
+After idletimeout minutes (15) without any, it sets the snap config key
+"idle", which nova.conf.d.idle.conf.j2 and neutron.idle.conf.j2 render
+into longer intervals, and has config-changes restart the units that
+read them: nova-compute, nova-conductor, nova-scheduler and the neutron
+agents, but none of the APIs, so the request that ends the idle spell
+isn't dropped. On the first sign of activity it puts the intervals
+back, once no instance has a task under way and no port is being
+bound: a nova-compute restarted mid-spawn puts the instance in ERROR,
+and the request that woke the cloud is often the one that started it.
+Until then, the services keep the idle intervals.
+
+It also measures the CPU time and the context switches (wakeups) of
+the snap's processes, while nothing is happening with the usual
+intervals and while idle, which "microstack.idle" shows.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import time
+
+import pymysql
+
+from microstack import config
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+ACCESS_LOG = os.path.join(SNAP_COMMON, 'log/nginx-access.log')
+MYSQL_SOCKET = os.path.join(SNAP_COMMON, 'run/mysql/mysqld.sock')
+STATE = os.path.join(SNAP_COMMON, 'lib/idle/state.json')
+
+INTERVAL = 30
+
+# Requests that only a person, or something acting for one, makes: a
+# token issued to anything but a service, and the dashboard.
+TOKEN_ISSUE = re.compile(r'"POST /v3/auth/tokens[^"]*" \d+ \d+ "[^"]*" '
+                         r'"(?P<agent>[^"]*)".*port=5000')
+DASHBOARD = re.compile(r'port=80$')
+SERVICE_AGENTS = ('nova-', 'neutron-', 'glance-', 'cinder-',
+                  'keystonemiddleware')
+
+# Latest change to what users make, in each database.
+CHANGES = (
+    'SELECT MAX(updated_at), MAX(created_at), MAX(deleted_at) '
+    'FROM nova.instances',
+    'SELECT MAX(updated_at), MAX(created_at) '
+    'FROM neutron.standardattributes',
+    'SELECT MAX(updated_at), MAX(created_at) FROM glance.images',
+)
+
+# Work under way in the units that switching restarts.
+IN_FLIGHT = (
+    'SELECT COUNT(*) FROM nova.instances '
+    'WHERE deleted = 0 AND task_state IS NOT NULL',
+    "SELECT COUNT(*) FROM neutron.ports WHERE status = 'BUILD'",
+)
+
+
+def settings():
+    return {
+        'mode': config.get('idlemode', 'off'),
+        'timeout': int(config.get('idletimeout', 15)) * 60,
+        'idle': str(config.get('idle', False)).lower() == 'true',
+    }
+
+
+class Activity(object):
+    """Notices requests and changes made since it last looked."""
+
+    def __init__(self):
+        self.inode = None
+        self.offset = 0
+        self.changes = None
+
+    def requests(self):
+        try:
+            stat = os.stat(ACCESS_LOG)
+        except OSError:
+            return False
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # Started, or rotated: only what comes from now on counts.
+            self.inode, self.offset = stat.st_ino, stat.st_size
+            return False
+        seen = False
+        with open(ACCESS_LOG) as log:
+            log.seek(self.offset)
+            for line in log:
+                if not line.endswith('\n'):
+                    break
+                self.offset += len(line)
+                line = line.rstrip('\n')
+                match = TOKEN_ISSUE.search(line)
+                if match and not match.group('agent').startswith(
+                        SERVICE_AGENTS):
+                    seen = True
+                elif DASHBOARD.search(line):
+                    seen = True
+        return seen
+
+    def database(self):
+        changes = query(CHANGES)
+        if changes is None:
+            return False
+        seen = self.changes is not None and changes != self.changes
+        self.changes = changes
+        return seen
+
+    def seen(self):
+        # Both, so that each keeps its place.
+        requests = self.requests()
+        return self.database() or requests
+
+
+def query(queries):
+    """Return the first row of each query, None for those that fail, or
+    None if MySQL can't be reached."""
+    rows = []
+    try:
+        conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                               connect_timeout=5)
+    except pymysql.MySQLError:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            for sql in queries:
+                try:
+                    cursor.execute(sql)
+                except pymysql.MySQLError:
+                    rows.append(None)
+                    continue
+                rows.append(cursor.fetchone())
+    finally:
+        conn.close()
+    return rows
+
+
+def in_flight():
+    """Return how many instance tasks and port bindings are under way."""
+    rows = query(IN_FLIGHT) or []
+    return sum(row[0] for row in rows if row)
+
+
+def usage():
+    """Return the CPU seconds and context switches of the snap's processes
+    so far."""
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = switches = 0
+    for proc in glob.glob('/proc/[0-9]*'):
+        try:
+            with open(proc + '/cmdline', 'rb') as f:
+                if b'/snap/microstack/' not in f.read():
+                    continue
+            with open(proc + '/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += float(int(fields[11]) + int(fields[12])) / ticks
+            for status in glob.glob(proc + '/task/*/status'):
+                with open(status) as f:
+                    for line in f:
+                        if line.startswith(('voluntary_ctxt_switches',
+                                            'nonvoluntary_ctxt_switches')):
+                            switches += int(line.split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+    return cpu, switches
+
+
+def load():
+    try:
+        with open(STATE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save(state):
+    if not os.path.isdir(os.path.dirname(STATE)):
+        os.makedirs(os.path.dirname(STATE))
+    with open(STATE + '.new', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(STATE + '.new', STATE)
+
+
+def switch(idle):
+    """Render the intervals for idle, or not, and restart their units."""
+    config.set({'idle': 'true' if idle else 'false'})
+    subprocess.check_call(['snap-openstack', 'setup'])
+    subprocess.check_call(['config-changes', 'apply'])
+
+
+def watch():
+    activity = Activity()
+    activity.seen()
+    state = load()
+    state['idle'] = settings()['idle']
+    measurements = state.setdefault('usage', {})
+    last_active = time.time()
+    before = None
+    while True:
+        time.sleep(INTERVAL)
+        current = settings()
+        now = time.time()
+        active = activity.seen()
+        if active:
+            last_active = now
+
+        # Usage over the last interval, while nothing happened, goes to
+        # the measurements of the intervals it ran with.
+        sample = usage()
+        if before and not active:
+            measured = measurements.setdefault(
+                'idle' if current['idle'] else 'quiet',
+                {'seconds': 0, 'cpu': 0, 'switches': 0})
+            measured['seconds'] += now - before[0]
+            measured['cpu'] += sample[0] - before[1]
+            measured['switches'] += sample[1] - before[2]
+        before = (now, sample[0], sample[1])
+
+        idle = current['idle']
+        if current['mode'] != 'auto':
+            idle = False
+        elif active:
+            idle = False
+        elif now - last_active >= current['timeout']:
+            idle = True
+        if idle != current['idle']:
+            busy = in_flight()
+            if busy:
+                # Tried again next interval.
+                print('Idle {} once {} instance task(s) and port '
+                      'binding(s) are done'.format(
+                          'on' if idle else 'off', busy))
+            else:
+                try:
+                    switch(idle)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print('Could not switch idle {}: {}'.format(
+                        'on' if idle else 'off', e))
+                else:
+                    print('Idle {}'.format('on' if idle else 'off'))
+                    state['idle'] = idle
+                    state['since'] = now
+                    # Restarts aren't what the intervals cost.
+                    before = None
+        save(state)
+
+
+def rates(measured):
+    if not measured or not measured['seconds']:
+        return None
+    return (100.0 * measured['cpu'] / measured['seconds'],
+            measured['switches'] / measured['seconds'])
+
+
+def status():
+    current = settings()
+    state = load()
+    print('idlemode {}, {}'.format(
+        current['mode'], 'idle' if current['idle'] else 'active'), end='')
+    if state.get('since'):
+        print(' since {}'.format(time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(state['since']))), end='')
+    print()
+    measurements = state.get('usage', {})
+    quiet = rates(measurements.get('quiet'))
+    idle = rates(measurements.get('idle'))
+    for name, measured in (('usual intervals', quiet), ('idle', idle)):
+        if measured:
+            print('{:<16} {:6.2f}% cpu {:8.1f} wakeups/s'.format(
+                name, *measured))
+    if quiet and idle:
+        print('saved            {:6.2f}% cpu {:8.1f} wakeups/s'.format(
+            quiet[0] - idle[0], quiet[1] - idle[1]))
+    else:
+        print('Not measured with both intervals yet.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Show what idle mode saves, or (as a daemon) stretch '
+                    'the periodic intervals while the cloud is idle.')
+    parser.add_argument('action', nargs='?', default='status',
+                        choices=['status', 'watch'])
+    args = parser.parse_args()
+
+    if args.action == 'watch':
+        watch()
+    else:
+        status()
+    return 0
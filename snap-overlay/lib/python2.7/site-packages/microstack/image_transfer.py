@@ -0,0 +1,85 @@
+"""Let nova-compute take images straight from glance's store.
+
+Glance keeps images as files in $SNAP_COMMON/lib/images, and, with
+show_image_direct_url on, tells Nova where. Nova hands file://
+locations to the transfer module registered for the scheme, which is
+this one (see the nova.image.download.modules entry point in
+microstack-0.0.0.dist-info), instead of streaming the image through
+glance-api.
+
+The image goes into Nova's _base cache by the cheapest means the
+filesystem offers:
+
+    reflink   a copy-on-write clone (btrfs, xfs), sharing the blocks.
+    link      a hard link, when the two are on the same filesystem.
+    copy      a plain copy, which still saves the trip through glance-api.
+
+If the file isn't here, e.g. on a compute node of its own, Nova falls
+back to downloading the image from Glance.
+"""
+import errno
+import fcntl
+import os
+import shutil
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(source, dest):
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link(source, dest):
+    os.link(source, dest)
+
+
+def copy(source, dest):
+    shutil.copyfile(source, dest)
+
+
+METHODS = [reflink, link, copy]
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class FileTransfer(object):
+
+    def download(self, context, url_parts, dst_path, metadata, **kwargs):
+        source = url_parts.path
+        if not os.path.isfile(source):
+            raise IOError(errno.ENOENT, 'Not on this host', source)
+        for method in METHODS:
+            _remove(dst_path)
+            try:
+                method(source, dst_path)
+            except (IOError, OSError) as e:
+                LOG.debug('Could not %(method)s %(source)s: %(error)s',
+                          {'method': method.__name__, 'source': source,
+                           'error': e})
+                continue
+            LOG.info('Took %(source)s from the image store by %(method)s',
+                     {'source': source, 'method': method.__name__})
+            return
+        _remove(dst_path)
+        raise IOError(errno.EIO, 'Could not take the image', source)
+
+
+def get_download_handler(**kwargs):
+    return FileTransfer()
+
+
+def get_schemes():
+    return ['file']
@@ -0,0 +1,226 @@
+"""Launch instances on microstack, ready to ssh into.
+
+The keypair, security group rules, flavor, image and networks are
+checked once per run, however many instances are launched, using
+targeted lookups rather than listing everything. Instances are taken
+from the warm pool (see warmpool.py) while it has any ready, and the
+rest are booted concurrently and followed by id, with backoff between
+status checks.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import time
+from concurrent import futures
+
+from keystoneauth1 import exceptions
+from six.moves.urllib import parse
+
+from microstack import cloud
+from microstack import timing
+from microstack import warmpool
+
+KEY_NAME = 'microstack'
+KEY_FILE = os.path.expanduser('~/.ssh/id_microstack')
+MAX_RETRIES = 3
+
+
+class LaunchFailed(Exception):
+    pass
+
+
+class Launcher(object):
+
+    def __init__(self, sess, timeline, args):
+        self.session = sess
+        self.timeline = timeline
+        self.args = args
+        self.nova = cloud.service(sess, 'compute')
+        self.neutron = cloud.service(sess, 'network')
+        self.glance = cloud.service(sess, 'image')
+
+    def _one(self, api, path, key, name):
+        found = api.get(path).json()[key]
+        if not found:
+            raise LaunchFailed('No {} named {}'.format(key.rstrip('s'), name))
+        return found[0]['id']
+
+    def lookup(self):
+        """Resolve the names given on the command line to ids."""
+        with self.timeline.span('lookup flavor, image and networks'):
+            flavors = self.nova.get('/flavors').json()['flavors']
+            matches = [f['id'] for f in flavors
+                       if self.args.flavor in (f['name'], f['id'])]
+            if not matches:
+                raise LaunchFailed('No flavor named ' + self.args.flavor)
+            self.flavor = matches[0]
+            self.image = self._one(
+                self.glance, '/v2/images?name=' + self.args.image,
+                'images', self.args.image)
+            self.network = self._one(
+                self.neutron, '/v2.0/networks?name=' + self.args.network,
+                'networks', self.args.network)
+            self.external = self._one(
+                self.neutron, '/v2.0/networks?name=' + self.args.external,
+                'networks', self.args.external)
+
+    def ensure_keypair(self):
+        with self.timeline.span('check keypair'):
+            try:
+                keypair = self.nova.get(
+                    '/os-keypairs/' + KEY_NAME).json()['keypair']
+            except exceptions.NotFound:
+                print('creating keypair ({})'.format(KEY_FILE))
+                keypair = self.nova.post('/os-keypairs', json={
+                    'keypair': {'name': KEY_NAME}}).json()['keypair']
+                directory = os.path.dirname(KEY_FILE)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory, 0o700)
+                fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0o600)
+                with os.fdopen(fd, 'w') as key_file:
+                    key_file.write(keypair['private_key'])
+            self.public_key = keypair['public_key']
+
+    def ensure_security_group(self):
+        """Allow ping and ssh in the project's default security group."""
+        with self.timeline.span('check security group rules'):
+            for allowed in cloud.allow_ping_and_ssh(
+                    self.neutron, self.session.get_project_id()):
+                print('Created security group rule for {}.'.format(allowed))
+
+    def _wait(self, server_id, deadline):
+        """Poll one server until it leaves BUILD, backing off as we go."""
+        delay = 0.5
+        while True:
+            server = self.nova.get('/servers/' + server_id).json()['server']
+            if server['status'] != 'BUILD':
+                return server
+            if time.time() > deadline:
+                raise LaunchFailed('{} still building after {}s'.format(
+                    server['name'], self.args.timeout))
+            time.sleep(delay)
+            delay = min(delay * 1.5, 5)
+
+    def boot(self, name):
+        """Boot one instance, retrying on ERROR, and give it a floating ip.
+
+        Returns the floating ip address, and how many seconds after the
+        launch started the server went ACTIVE and got its floating ip.
+        """
+        for attempt in range(1, MAX_RETRIES + 1):
+            with self.timeline.span(name + ' build'):
+                server = self.nova.post('/servers', json={'server': {
+                    'name': name,
+                    'flavorRef': self.flavor,
+                    'imageRef': self.image,
+                    'key_name': KEY_NAME,
+                    'networks': [{'uuid': self.network}],
+                }}).json()['server']
+                server = self._wait(
+                    server['id'], time.time() + self.args.timeout)
+            if server['status'] == 'ACTIVE':
+                active = self.timeline.elapsed()
+                break
+            self.nova.delete('/servers/' + server['id'])
+            if attempt == MAX_RETRIES:
+                raise LaunchFailed(
+                    '{} went to {}. See /var/snap/microstack/common/log '
+                    'for details.'.format(name, server['status']))
+            print('I ran into an issue launching {}. Retrying ... '
+                  '(try {} of {})'.format(name, attempt + 1, MAX_RETRIES))
+
+        with self.timeline.span(name + ' networking'):
+            port = self.neutron.get(
+                '/v2.0/ports?device_id=' + server['id']).json()['ports'][0]
+            fip = self.neutron.post('/v2.0/floatingips', json={
+                'floatingip': {
+                    'floating_network_id': self.external,
+                    'port_id': port['id'],
+                }}).json()['floatingip']
+        return fip['floating_ip_address'], active, self.timeline.elapsed()
+
+    def claim(self, name):
+        """Take an instance from the warm pool, if there is one."""
+        claimed = warmpool.claim(
+            name, self.args.flavor, self.args.image, self.args.network,
+            self.args.external, self.public_key)
+        return claimed[1] if claimed else None
+
+    def run(self, names):
+        pool = futures.ThreadPoolExecutor(max_workers=self.args.concurrency)
+        # None of the checks depend on each other.
+        for job in [pool.submit(self.lookup),
+                    pool.submit(self.ensure_keypair),
+                    pool.submit(self.ensure_security_group)]:
+            job.result()
+
+        failed = 0
+        for name in list(names):
+            with self.timeline.span(name + ' from the warm pool'):
+                claimed = self.claim(name)
+            if claimed:
+                names.remove(name)
+                print('{} taken from the warm pool, floating ip {} after '
+                      '{:.2f}s'.format(name, claimed, self.timeline.elapsed()))
+                print("Access {} with 'ssh -i {} cirros@{}'".format(
+                    name, KEY_FILE, claimed))
+            else:
+                break
+
+        if names:
+            print('Launching {} ...'.format(', '.join(names)))
+        jobs = dict((pool.submit(self.boot, name), name) for name in names)
+        for job in futures.as_completed(jobs):
+            name = jobs[job]
+            try:
+                ip, active, networked = job.result()
+            except (LaunchFailed, exceptions.ClientException) as e:
+                failed += 1
+                print('{}: {}'.format(name, e))
+                continue
+            print('{} ACTIVE after {:.2f}s, floating ip {} after {:.2f}s'
+                  .format(name, active, ip, networked))
+            print("Access {} with 'ssh -i {} cirros@{}'".format(
+                name, KEY_FILE, ip))
+        return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Launch instances, with ping and ssh allowed and a '
+                    'floating ip each.')
+    parser.add_argument('name', help='name of the server; with --count, '
+                                     'servers are named <name>-1, <name>-2, ...')
+    parser.add_argument('--count', type=int, default=1,
+                        help='number of servers to launch')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='maximum number of servers to boot at once')
+    parser.add_argument('--flavor', default='m1.tiny')
+    parser.add_argument('--image', default='cirros')
+    parser.add_argument('--network', default='test')
+    parser.add_argument('--external', default='external',
+                        help='network to allocate floating ips from')
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='seconds to wait for each server to boot')
+    args = parser.parse_args()
+
+    if args.count == 1:
+        names = [args.name]
+    else:
+        names = ['{}-{}'.format(args.name, i)
+                 for i in range(1, args.count + 1)]
+
+    timeline = timing.Timeline()
+    try:
+        failed = Launcher(cloud.session_from_env(), timeline, args).run(names)
+    except LaunchFailed as e:
+        print(e)
+        return 1
+    timeline.report()
+
+    host = parse.urlparse(os.environ['OS_AUTH_URL']).hostname
+    print("You can also visit the openstack dashboard at 'http://{}/'".format(
+        host))
+    return 1 if failed else 0
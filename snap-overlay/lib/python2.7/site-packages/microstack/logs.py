@@ -0,0 +1,357 @@
+"""Set the services' log levels, and rotate and compress their logs.
+
+Each service logs at the level of "snap set microstack
+loglevel.<service>=debug|info|warning|error" (info by default), for
+the SERVICES below. "apply" (run by the configure hook) turns those
+into the snap config keys the templates render: <service>loglevel,
+and for the oslo.log services <service>logdebug and
+<service>loglevels, their default_log_levels. "snap set microstack
+logformat=json" has the Python services write a JSON object per record
+instead of a line of text.
+
+The logs in $SNAP_COMMON/log are rotated by "rotate", which the
+logrotate daemon runs every INTERVAL seconds, once they are larger
+than logmaxsize MB (50), or logmaxage days (7) old. x.log is renamed to
+x.log.1, and the one before that is compressed to x.log.2.gz, and so
+on, keeping logkeep of them (5). x.log.1 is compressed on the next
+rotation, not this one, as the writer may still have it open for a
+moment. Writers reopen their logs as each writes them:
+
+    oslo.log      WatchedFileHandler, which reopens when the file is
+                  renamed, as does horizon.log's.
+    uwsgi         when its touch-logreopen file is touched.
+    nginx         on SIGUSR1.
+    mysql         FLUSH ERROR LOGS and FLUSH SLOW LOGS.
+    rabbitmq      rabbitmqctl rotate_logs.
+    openvswitch   ovs-appctl vlog/reopen, for ovs and ovn's daemons.
+
+Any other log in $SNAP_COMMON/log, e.g. libvirt's, is copied to x.log.1
+and truncated in place instead, which loses what is written in between.
+virtlogd rotates the instances' console logs in log/libvirt/qemu
+itself.
+
+"status" (the default) shows each service's level, and the size and
+write rate of each log.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import pymysql
+import yaml
+
+from microstack import config
+
+SNAP = os.environ.get('SNAP', '/snap/microstack/current')
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+SNAP_OPENSTACK = os.path.join(SNAP, 'snap-openstack.yaml')
+LOG_DIR = os.path.join(SNAP_COMMON, 'log')
+STATE = os.path.join(SNAP_COMMON, 'lib/logs/state.json')
+MYSQL_SOCKET = os.path.join(SNAP_COMMON, 'run/mysql/mysqld.sock')
+OVS_RUNDIR = os.path.join(SNAP_COMMON, 'run/openvswitch')
+
+INTERVAL = 300
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+DEFAULT_LEVEL = 'info'
+
+# Logs in LOG_DIR whose writers have a way to reopen them.
+MYSQL_LOGS = {
+    'mysql/error.log': 'FLUSH ERROR LOGS',
+    'mysql/slow.log': 'FLUSH SLOW LOGS',
+}
+# log: the ovs-appctl target of the daemon writing it.
+OVS_LOGS = {
+    'openvswitch/ovs-vswitchd.log': 'ovs-vswitchd',
+    'openvswitch/ovsdb-server.log': 'ovsdb-server',
+    'openvswitch/ovn-northd.log': 'ovn-northd',
+    'openvswitch/ovn-controller.log': 'ovn-controller',
+    'openvswitch/ovsdb-server-nb.log': os.path.join(OVS_RUNDIR,
+                                                    'ovnnb_db.ctl'),
+    'openvswitch/ovsdb-server-sb.log': os.path.join(OVS_RUNDIR,
+                                                    'ovnsb_db.ctl'),
+}
+RABBITMQ_LOGS = 'rabbitmq/*.log'
+# Rotated by their writer.
+SKIPPED = ('libvirt/qemu',)
+
+# service: the loggers of its own code, which loglevel.<service> sets
+# when it is above info. None for services that don't use oslo.log.
+SERVICES = {
+    'keystone': ['keystone'],
+    'nova': ['nova'],
+    'neutron': ['neutron', 'networking_ovn'],
+    'glance': ['glance', 'glance_store'],
+    'horizon': None,
+}
+
+# The libraries the services share, which follow the level too.
+LIBRARIES = ['oslo_messaging', 'oslo.messaging', 'oslo_service', 'oslo_db',
+             'oslo_policy', 'oslo_concurrency', 'oslo_cache', 'oslo.cache',
+             'keystonemiddleware']
+
+# oslo.log's own default_log_levels, which a setting replaces.
+OSLO_DEFAULT_LOG_LEVELS = [
+    'amqp=WARN', 'amqplib=WARN', 'boto=WARN', 'qpid=WARN', 'sqlalchemy=WARN',
+    'suds=INFO', 'oslo.messaging=INFO', 'oslo_messaging=INFO',
+    'iso8601=WARN', 'requests.packages.urllib3.connectionpool=WARN',
+    'urllib3.connectionpool=WARN', 'websocket=WARN',
+    'requests.packages.urllib3.util.retry=WARN', 'urllib3.util.retry=WARN',
+    'keystonemiddleware=WARN', 'routes.middleware=WARN', 'stevedore=WARN',
+    'taskflow=WARN', 'keystoneauth=WARN', 'oslo.cache=INFO',
+    'dogpile.core.dogpile=INFO',
+]
+
+
+def levels(overrides):
+    """Return the level of each service, from loglevel.<service>."""
+    found = {}
+    for service in SERVICES:
+        level = str(overrides.get(service, DEFAULT_LEVEL)).lower()
+        if level not in LEVELS:
+            print('loglevel.{} should be one of {}, not {}; using {}'.format(
+                service, ', '.join(LEVELS), level, DEFAULT_LEVEL))
+            level = DEFAULT_LEVEL
+        found[service] = level
+    return found
+
+
+def default_log_levels(loggers, level):
+    """Return oslo.log's default_log_levels for a service at level."""
+    if level in ('debug', 'info'):
+        return ','.join(OSLO_DEFAULT_LOG_LEVELS)
+    # oslo.log's names for the levels, in order.
+    names = ['INFO', 'WARN', 'ERROR']
+    name = {'warning': 'WARN', 'error': 'ERROR'}[level]
+    raised = loggers + LIBRARIES
+    found = ['{}={}'.format(logger, name) for logger in raised]
+    for pair in OSLO_DEFAULT_LOG_LEVELS:
+        logger, default = pair.split('=')
+        if logger in raised:
+            continue
+        if names.index(default) < names.index(name):
+            pair = '{}={}'.format(logger, name)
+        found.append(pair)
+    return ','.join(found)
+
+
+def snap_keys(service_levels):
+    keys = {}
+    for service, level in service_levels.items():
+        keys['{}loglevel'.format(service)] = level.upper()
+        if SERVICES[service] is not None:
+            keys['{}logdebug'.format(service)] = str(level == 'debug').lower()
+            keys['{}loglevels'.format(service)] = default_log_levels(
+                SERVICES[service], level)
+    return keys
+
+
+def writers():
+    """Return how the writer of each log is told to reopen it.
+
+    As snap-openstack.yaml launches them: "watched" for oslo.log's
+    log-files, which need nothing, the touch-logreopen file of uwsgi
+    logs, or the unit to send SIGUSR1 to. Then the statement that has
+    mysqld reopen its log, rabbitmqctl, the ovs-appctl target, and
+    "copy" for the rest of the logs in LOG_DIR.
+    """
+    with open(SNAP_OPENSTACK) as f:
+        spec = yaml.safe_load(f)
+    found = {}
+    for name, entry_point in spec.get('entry_points', {}).items():
+        if 'log-file' in entry_point:
+            path = entry_point['log-file'].format(snap_common=SNAP_COMMON)
+            found[path] = ('watched', None)
+        if 'uwsgi-log' in entry_point:
+            path = entry_point['uwsgi-log'].format(snap_common=SNAP_COMMON)
+            found[path] = ('touch', os.path.join(
+                SNAP_COMMON, 'run', os.path.basename(path)[:-len('.log')] +
+                '.logreopen'))
+        if entry_point.get('type') == 'nginx':
+            for log in ('nginx-access.log', 'nginx-error.log'):
+                found[os.path.join(LOG_DIR, log)] = ('signal', name)
+    found[os.path.join(LOG_DIR, 'horizon.log')] = ('watched', None)
+    for log, statement in MYSQL_LOGS.items():
+        found[os.path.join(LOG_DIR, log)] = ('sql', statement)
+    for path in glob.glob(os.path.join(LOG_DIR, RABBITMQ_LOGS)):
+        found[path] = ('rabbitmqctl', None)
+    for log, target in OVS_LOGS.items():
+        found[os.path.join(LOG_DIR, log)] = ('appctl', target)
+    for root, dirs, files in os.walk(LOG_DIR):
+        dirs[:] = [d for d in dirs if os.path.relpath(
+            os.path.join(root, d), LOG_DIR) not in SKIPPED]
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith('.log') and path not in found:
+                found[path] = ('copy', None)
+    return found
+
+
+def load():
+    try:
+        with open(STATE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save(state):
+    if not os.path.isdir(os.path.dirname(STATE)):
+        os.makedirs(os.path.dirname(STATE))
+    with open(STATE + '.new', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(STATE + '.new', STATE)
+
+
+def compress(path, to):
+    with open(path, 'rb') as src:
+        with gzip.open(to + '.new', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    os.rename(to + '.new', to)
+    os.unlink(path)
+
+
+def rotate(path, keep, copy=False):
+    """Move path to path.1, compressing and shifting the older ones.
+
+    With copy, path is copied and truncated instead, for writers that
+    can't be told to reopen it.
+    """
+    for n in range(keep, 1, -1):
+        older = '{}.{}.gz'.format(path, n)
+        if os.path.exists(older):
+            if n == keep:
+                os.unlink(older)
+            else:
+                os.rename(older, '{}.{}.gz'.format(path, n + 1))
+    if os.path.exists(path + '.1'):
+        if keep > 1:
+            compress(path + '.1', path + '.2.gz')
+        else:
+            os.unlink(path + '.1')
+    if copy:
+        shutil.copyfile(path, path + '.1')
+        with open(path, 'r+') as f:
+            f.truncate()
+    else:
+        os.rename(path, path + '.1')
+
+
+def reopen(how, target):
+    if how == 'touch':
+        with open(target, 'a'):
+            os.utime(target, None)
+    elif how == 'signal':
+        subprocess.call(['systemctl', 'kill', '--kill-who=main',
+                         '--signal=USR1', 'snap.microstack.{}'.format(target)])
+    elif how == 'sql':
+        try:
+            conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                                   connect_timeout=5)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(target)
+            finally:
+                conn.close()
+        except pymysql.MySQLError as e:
+            print('Could not reopen the mysql logs: {}'.format(e))
+    elif how == 'rabbitmqctl':
+        subprocess.call(['rabbitmqctl', '-q', 'rotate_logs'],
+                        env=dict(os.environ, HOME=os.path.join(
+                            SNAP_COMMON, 'lib/rabbitmq')))
+    elif how == 'appctl':
+        subprocess.call(['ovs-wrapper', 'ovs-appctl', '-t', target,
+                         'vlog/reopen'])
+
+
+def rotate_all(max_bytes, max_age, keep, now=None):
+    now = now or time.time()
+    state = load()
+    rotated = state.setdefault('rotated', {})
+    sizes = state.setdefault('sizes', {})
+    for path, (how, target) in sorted(writers().items()):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        # Not rotated by us yet: its age counts from now.
+        since = rotated.setdefault(path, now)
+        if size and (size > max_bytes or now - since > max_age):
+            print('Rotating {} ({:.1f} MB)'.format(
+                path, size / 1048576.0))
+            rotate(path, keep, copy=how == 'copy')
+            reopen(how, target)
+            rotated[path] = now
+            size = 0
+        # What each log grew by, for the write rate in status.
+        last = sizes.get(path)
+        if last and last[1] <= size:
+            sizes[path] = [now, size, (size - last[1]) / (now - last[0])]
+        else:
+            sizes[path] = [now, size, last[2] if last else None]
+    save(state)
+
+
+def limits():
+    return (float(config.get('logmaxsize', 50)) * 1048576,
+            float(config.get('logmaxage', 7)) * 86400,
+            int(config.get('logkeep', 5)))
+
+
+def status():
+    service_levels = levels(config.get('loglevel', {}))
+    print('format: {}'.format(config.get('logformat', 'text')))
+    print('level: {}'.format(', '.join(
+        '{} {}'.format(s, service_levels[s]) for s in sorted(SERVICES))))
+    max_bytes, max_age, keep = limits()
+    print('rotated over {:.0f} MB or {:.0f} days, keeping {}'.format(
+        max_bytes / 1048576, max_age / 86400, keep))
+    sizes = load().get('sizes', {})
+    print('{:<40} {:>9} {:>10} {:>9}'.format(
+        'log', 'size MB', 'rotated MB', 'KB/min'))
+    total = 0
+    for path in sorted(writers()):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        old = sum(os.path.getsize(p) for p in glob.glob(path + '.*'))
+        rate = (sizes.get(path) or [None] * 3)[2]
+        total += rate or 0
+        print('{:<40} {:>9.1f} {:>10.1f} {:>9}'.format(
+            os.path.basename(path), size / 1048576.0, old / 1048576.0,
+            '-' if rate is None else '{:.1f}'.format(rate * 60 / 1024)))
+    print('written: {:.1f} KB/min'.format(total * 60 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Set the services\' log levels, and rotate and '
+                    'compress their logs.')
+    parser.add_argument('action', nargs='?', default='status',
+                        choices=['status', 'apply', 'rotate', 'watch'],
+                        help='show the levels and logs (default), apply '
+                             'loglevel.* to the snap config the templates '
+                             'are rendered from (hooks only), rotate the '
+                             'logs once, or every {} seconds'.format(
+                                 INTERVAL))
+    args = parser.parse_args()
+
+    if args.action == 'apply':
+        config.set(snap_keys(levels(config.get('loglevel', {}))))
+    elif args.action == 'rotate':
+        rotate_all(*limits())
+    elif args.action == 'watch':
+        while True:
+            rotate_all(*limits())
+            time.sleep(INTERVAL)
+    else:
+        status()
+    return 0
@@ -0,0 +1,149 @@
+"""Set up RabbitMQ for the services, and show its queues.
+
+Nova and Neutron each get a vhost, and a user of their own with
+permissions on it only, so that neither sees the other's queues (the
+transport_url in their templates points at theirs). In every vhost,
+policies keep the queues from piling up on a cloud that runs for
+weeks:
+
+    transient      reply_ and fanout queues, which every process that
+                   starts leaves behind, are deleted after an hour
+                   unused, and their messages expire after ten minutes.
+    notifications  nothing consumes notifications here, so they expire
+                   after an hour, at most NOTIFICATIONS_MAX are kept,
+                   and they are kept on disk rather than in memory.
+    idle           any other queue is deleted after a day unused, e.g.
+                   those of agents that no longer run.
+
+"apply" (run by the configure hook) creates what is missing and
+rewrites policies that differ; it only calls rabbitmqctl to change
+things, which is slow. "status" (the default) shows the depth and
+consumers of the queues in each vhost, and the memory the broker uses.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+
+# vhost: user, whose password is its name, as for the databases.
+VHOSTS = {
+    'nova': 'nova',
+    'neutron': 'neutron',
+}
+
+NOTIFICATIONS_MAX = 10000
+
+# name: (pattern, definition, priority)
+POLICIES = {
+    'transient': ('^(reply_|.*_fanout_)',
+                  {'expires': 3600000, 'message-ttl': 600000}, 10),
+    'notifications': ('^(versioned_)?notifications[.]',
+                      {'message-ttl': 3600000,
+                       'max-length': NOTIFICATIONS_MAX,
+                       'queue-mode': 'lazy'}, 10),
+    'idle': ('.*', {'expires': 86400000}, 0),
+}
+
+
+def rabbitmqctl(*args):
+    return subprocess.check_output(
+        ('rabbitmqctl', '-q') + args, universal_newlines=True)
+
+
+def rows(*args):
+    """Return the tab separated rows that rabbitmqctl lists."""
+    return [line.split('\t') for line in rabbitmqctl(*args).splitlines()
+            if line]
+
+
+def policies(vhost):
+    """Return the policies in vhost, as POLICIES has them."""
+    found = {}
+    for row in rows('list_policies', '-p', vhost):
+        # vhost, name, apply-to, pattern, definition, priority
+        if len(row) == 6:
+            found[row[1]] = (row[3], json.loads(row[4]), int(row[5]))
+    return found
+
+
+def apply():
+    vhosts = set(row[0] for row in rows('list_vhosts'))
+    users = set(row[0] for row in rows('list_users'))
+    for vhost, user in sorted(VHOSTS.items()):
+        if vhost not in vhosts:
+            print('Adding vhost {}'.format(vhost))
+            rabbitmqctl('add_vhost', vhost)
+        if user not in users:
+            print('Adding user {}'.format(user))
+            rabbitmqctl('add_user', user, user)
+        if vhost not in vhosts or user not in users:
+            rabbitmqctl('set_permissions', '-p', vhost, user,
+                        '.*', '.*', '.*')
+
+    # Policies in the default vhost too, for queues left there by the
+    # services before they had their own.
+    for vhost in sorted(VHOSTS) + ['/']:
+        found = policies(vhost)
+        for name, (pattern, definition, priority) in sorted(
+                POLICIES.items()):
+            if found.get(name) != (pattern, definition, priority):
+                print('Setting policy {} in vhost {}'.format(name, vhost))
+                rabbitmqctl('set_policy', '-p', vhost,
+                            '--priority', str(priority),
+                            '--apply-to', 'queues', name, pattern,
+                            json.dumps(definition, sort_keys=True))
+
+
+def queues(vhost):
+    """Return the name, messages, consumers and memory of each queue."""
+    found = []
+    for row in rows('list_queues', '-p', vhost, 'name', 'messages',
+                    'consumers', 'memory'):
+        if len(row) == 4 and row[1].isdigit():
+            found.append((row[0],) + tuple(int(n) for n in row[1:]))
+    return found
+
+
+def memory():
+    """Return the memory the broker uses, in bytes."""
+    return int(rabbitmqctl('eval', 'erlang:memory(total).').strip())
+
+
+def status(top):
+    print('{:<10} {:>6} {:>9} {:>9} {:>11} {:>10}'.format(
+        'vhost', 'queues', 'messages', 'consumers', 'unconsumed',
+        'memory MB'))
+    deepest = []
+    for vhost in sorted(VHOSTS) + ['/']:
+        found = queues(vhost)
+        print('{:<10} {:>6} {:>9} {:>9} {:>11} {:>10.1f}'.format(
+            vhost, len(found), sum(q[1] for q in found),
+            sum(q[2] for q in found), sum(1 for q in found if not q[2]),
+            sum(q[3] for q in found) / 1048576.0))
+        deepest.extend((vhost,) + q for q in found)
+    print('broker memory: {:.1f} MB'.format(memory() / 1048576.0))
+    deepest.sort(key=lambda q: q[2], reverse=True)
+    if top and deepest and deepest[0][2]:
+        print('deepest queues:')
+        for vhost, name, messages, consumers, _ in deepest[:top]:
+            if messages:
+                print('  {} {}: {} messages, {} consumers'.format(
+                    vhost, name, messages, consumers))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Set up the RabbitMQ vhosts, users and policies of '
+                    'the services, or show their queues.')
+    parser.add_argument('action', nargs='?', default='status',
+                        choices=['status', 'apply'])
+    parser.add_argument('--top', type=int, default=5,
+                        help='how many of the deepest queues to show')
+    args = parser.parse_args()
+
+    if args.action == 'apply':
+        apply()
+    else:
+        status(args.top)
+    return 0
@@ -0,0 +1,360 @@
+"""Serve metrics for the whole stack in the Prometheus text format.
+
+Gathered on each scrape:
+
+- uwsgi: workers by status, requests served and the listen queue of
+  each uwsgi app, from its stats socket.
+- nginx: connections and requests, from stub_status.
+- MySQL: thread and query counters, from SHOW GLOBAL STATUS.
+- RabbitMQ: messages and consumers per queue in each vhost, and the
+  broker's memory, from rabbitmqctl, which is slow enough that its
+  answer is reused for RABBITMQ_TTL seconds.
+
+Request rates and latency histograms per service are built by
+following nginx's access log, whose "timed" format records the port
+and the request time.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+
+import pymysql
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import request
+
+from microstack import messaging
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+RUN = os.path.join(SNAP_COMMON, 'run')
+ACCESS_LOG = os.path.join(SNAP_COMMON, 'log/nginx-access.log')
+MYSQL_SOCKET = os.path.join(RUN, 'mysql/mysqld.sock')
+NGINX_STATUS = 'http://127.0.0.1:8091/nginx_status'
+
+# uwsgi app: stats socket
+UWSGI = {
+    'keystone': 'keystone-api-stats.sock',
+    'placement': 'placement-api-stats.sock',
+    'horizon': 'horizon-stats.sock',
+    'cinder': 'cinder-api-stats.sock',
+}
+
+# nginx port: service
+PORTS = {
+    '5000': 'keystone',
+    '8778': 'placement',
+    '8776': 'cinder',
+    '80': 'horizon',
+}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+MYSQL_STATUS = (
+    'Threads_connected', 'Threads_running', 'Questions', 'Slow_queries',
+    'Connections', 'Aborted_connects',
+)
+
+RABBITMQ_TTL = 30
+
+TIMED = re.compile(r'" (\d{3}) .* rt=([\d.]+) .*port=(\d+)')
+
+
+class Metrics(object):
+    """Samples in the text format, grouped by family."""
+
+    def __init__(self):
+        self.families = collections.OrderedDict()
+
+    def declare(self, name, kind, help):
+        if name not in self.families:
+            self.families[name] = ['# HELP {} {}'.format(name, help),
+                                   '# TYPE {} {}'.format(name, kind)]
+
+    def add(self, name, kind, help, value, **labels):
+        self.declare(name, kind, help)
+        self.sample(name, name, value, **labels)
+
+    def sample(self, family, name, value, **labels):
+        if labels:
+            name += '{' + ','.join('{}="{}"'.format(k, v) for k, v in
+                                   sorted(labels.items())) + '}'
+        self.families[family].append('{} {}'.format(name, value))
+
+    def text(self):
+        return '\n'.join(line for lines in self.families.values()
+                         for line in lines) + '\n'
+
+
+class AccessLog(threading.Thread):
+    """Follows the access log, counting requests and their latency."""
+
+    def __init__(self, path=ACCESS_LOG):
+        super(AccessLog, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.lock = threading.Lock()
+        self.requests = {}   # (service, code): count
+        self.buckets = {}    # service: [count per bucket]
+        self.sums = {}       # service: seconds
+
+    def observe(self, line):
+        match = TIMED.search(line)
+        if not match or match.group(3) not in PORTS:
+            return
+        code, seconds, port = match.groups()
+        service = PORTS[port]
+        seconds = float(seconds)
+        with self.lock:
+            key = (service, code)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            buckets = self.buckets.setdefault(service, [0] * len(BUCKETS))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.sums[service] = self.sums.get(service, 0) + seconds
+
+    def run(self):
+        inode, log = None, None
+        while True:
+            try:
+                if os.stat(self.path).st_ino != inode:
+                    # Started, or rotated: read the new file from the
+                    # start, except on startup.
+                    new = open(self.path)
+                    if log is None:
+                        new.seek(0, os.SEEK_END)
+                    else:
+                        log.close()
+                    log, inode = new, os.fstat(new.fileno()).st_ino
+            except (IOError, OSError):
+                time.sleep(1)
+                continue
+            line = log.readline()
+            if line.endswith('\n'):
+                self.observe(line)
+            else:
+                if line:
+                    log.seek(-len(line), os.SEEK_CUR)
+                time.sleep(0.5)
+
+    def collect(self, metrics):
+        with self.lock:
+            for (service, code), count in sorted(self.requests.items()):
+                metrics.add('microstack_http_requests_total', 'counter',
+                            'Requests through nginx.', count,
+                            service=service, code=code)
+            for service, buckets in sorted(self.buckets.items()):
+                name = 'microstack_http_request_duration_seconds'
+                metrics.declare(name, 'histogram',
+                                'Time nginx took to answer.')
+                for bound, count in zip(BUCKETS, buckets):
+                    metrics.sample(name, name + '_bucket', count,
+                                   service=service, le=bound)
+                total = sum(v for (s, _), v in self.requests.items()
+                            if s == service)
+                metrics.sample(name, name + '_bucket', total,
+                               service=service, le='+Inf')
+                metrics.sample(name, name + '_sum',
+                               round(self.sums[service], 3), service=service)
+                metrics.sample(name, name + '_count', total, service=service)
+
+
+def uwsgi_stats(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(2)
+    try:
+        sock.connect(path)
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    return json.loads(data.decode('utf-8', 'replace'))
+
+
+def collect_uwsgi(metrics):
+    for service, sock in sorted(UWSGI.items()):
+        try:
+            stats = uwsgi_stats(os.path.join(RUN, sock))
+        except (socket.error, ValueError):
+            metrics.add('microstack_up', 'gauge',
+                        'Whether the source answered.', 0, source=service)
+            continue
+        metrics.add('microstack_up', 'gauge', 'Whether the source answered.',
+                    1, source=service)
+        statuses = {}
+        for worker in stats.get('workers', []):
+            statuses[worker['status']] = statuses.get(worker['status'], 0) + 1
+        for status in ('busy', 'idle'):
+            statuses.setdefault(status, 0)
+        for status, count in sorted(statuses.items()):
+            metrics.add('microstack_uwsgi_workers', 'gauge',
+                        'uwsgi workers by status.', count,
+                        service=service, status=status)
+        workers = stats.get('workers', [])
+        metrics.add('microstack_uwsgi_requests_total', 'counter',
+                    'Requests served by the uwsgi workers.',
+                    sum(w.get('requests', 0) for w in workers),
+                    service=service)
+        metrics.add('microstack_uwsgi_listen_queue', 'gauge',
+                    'Requests waiting for a free uwsgi worker.',
+                    stats.get('listen_queue', 0), service=service)
+        metrics.add('microstack_uwsgi_listen_queue_errors_total', 'counter',
+                    'Requests turned away with the listen queue full.',
+                    stats.get('listen_queue_errors', 0), service=service)
+
+
+def collect_nginx(metrics):
+    try:
+        text = request.urlopen(NGINX_STATUS, timeout=2).read().decode()
+    except (IOError, socket.error):
+        metrics.add('microstack_up', 'gauge', 'Whether the source answered.',
+                    0, source='nginx')
+        return
+    metrics.add('microstack_up', 'gauge', 'Whether the source answered.', 1,
+                source='nginx')
+    numbers = [int(n) for n in re.findall(r'\d+', text)]
+    # Active connections: A / accepts handled requests / A H R /
+    # Reading: R Writing: W Waiting: W
+    active, accepted, handled, requests, reading, writing, waiting = numbers
+    for state, count in [('active', active), ('reading', reading),
+                         ('writing', writing), ('waiting', waiting)]:
+        metrics.add('microstack_nginx_connections', 'gauge',
+                    'nginx client connections by state.', count, state=state)
+    metrics.add('microstack_nginx_connections_accepted_total', 'counter',
+                'Client connections nginx accepted.', accepted)
+    metrics.add('microstack_nginx_connections_handled_total', 'counter',
+                'Client connections nginx handled.', handled)
+    metrics.add('microstack_nginx_requests_total', 'counter',
+                'Client requests to nginx.', requests)
+
+
+def collect_mysql(metrics):
+    try:
+        conn = pymysql.connect(unix_socket=MYSQL_SOCKET, user='root',
+                               connect_timeout=2)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SHOW GLOBAL STATUS')
+                status = dict(cursor.fetchall())
+        finally:
+            conn.close()
+    except pymysql.MySQLError:
+        metrics.add('microstack_up', 'gauge', 'Whether the source answered.',
+                    0, source='mysql')
+        return
+    metrics.add('microstack_up', 'gauge', 'Whether the source answered.', 1,
+                source='mysql')
+    for name in MYSQL_STATUS:
+        if name in status:
+            metrics.add('microstack_mysql_' + name.lower(),
+                        'gauge' if name.startswith('Threads') else 'counter',
+                        'MySQL status variable {}.'.format(name),
+                        status[name])
+
+
+class RabbitMQ(object):
+
+    def __init__(self):
+        self.queues = None
+        self.memory = 0
+        self.fetched = 0
+
+    def fetch(self):
+        queues = []
+        for vhost in sorted(messaging.VHOSTS) + ['/']:
+            queues.extend((vhost,) + queue[:3]
+                          for queue in messaging.queues(vhost))
+        return queues, messaging.memory()
+
+    def collect(self, metrics):
+        if time.time() - self.fetched > RABBITMQ_TTL:
+            try:
+                self.queues, self.memory = self.fetch()
+            except (OSError, ValueError, subprocess.CalledProcessError):
+                self.queues = None
+            self.fetched = time.time()
+        metrics.add('microstack_up', 'gauge', 'Whether the source answered.',
+                    int(self.queues is not None), source='rabbitmq')
+        if self.queues is None:
+            return
+        metrics.add('microstack_rabbitmq_memory_bytes', 'gauge',
+                    'Memory the broker uses.', self.memory)
+        for vhost, name, messages, consumers in self.queues:
+            metrics.add('microstack_rabbitmq_queue_messages', 'gauge',
+                        'Messages waiting in the queue.', messages,
+                        vhost=vhost, queue=name)
+            metrics.add('microstack_rabbitmq_queue_consumers', 'gauge',
+                        'Consumers of the queue.', consumers,
+                        vhost=vhost, queue=name)
+
+
+class Exporter(object):
+
+    def __init__(self):
+        self.access_log = AccessLog()
+        self.rabbitmq = RabbitMQ()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.access_log.start()
+
+    def scrape(self):
+        metrics = Metrics()
+        with self.lock:
+            collect_uwsgi(metrics)
+            collect_nginx(metrics)
+            collect_mysql(metrics)
+            self.rabbitmq.collect(metrics)
+            self.access_log.collect(metrics)
+        return metrics.text()
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def handler(exporter):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.scrape().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve Prometheus metrics for microstack on '
+                    'http://<listen>/metrics.')
+    parser.add_argument('--listen', default='127.0.0.1:9180',
+                        help='address and port to serve on')
+    args = parser.parse_args()
+
+    host, port = args.listen.rsplit(':', 1)
+    exporter = Exporter()
+    exporter.start()
+    Server((host, int(port)), handler(exporter)).serve_forever()
@@ -0,0 +1,228 @@
+"""Wait for the microstack services to be ready to do work.
+
+An open port only says that something is listening; nginx listens on
+the API ports long before the uwsgi apps behind it can answer. The
+probes here talk to each service at the application level instead, and
+run concurrently, each with its own backoff and deadline.
+
+RabbitMQ readiness is read from its startup log, which is watched with
+inotify rather than polled.
+"""
+from __future__ import print_function
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+import time
+from concurrent import futures
+
+import pymysql
+from six.moves.urllib import error
+from six.moves.urllib import request
+
+from microstack import timing
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+RABBITMQ_LOG = os.path.join(SNAP_COMMON, 'log/rabbitmq/startup_log')
+MYSQL_SOCKET = os.path.join(SNAP_COMMON, 'run/mysql/mysqld.sock')
+
+# The api services are probed through their version discovery
+# documents, which need no token.
+APIS = {
+    'keystone': (5000, '/v3'),
+    'nova': (8774, '/'),
+    'placement': (8778, '/'),
+    'neutron': (9696, '/'),
+    'glance': (9292, '/'),
+    'horizon': (80, '/'),
+}
+
+# Seconds each service gets to become ready.
+DEADLINES = {
+    'mysql': 120,
+    'rabbitmq': 120,
+    'keystone': 120,
+    'nova': 120,
+    'placement': 120,
+    'neutron': 120,
+    'glance': 120,
+    'horizon': 180,
+}
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+
+
+class NotReady(Exception):
+    pass
+
+
+def probe_api(host, port, path):
+    """Anything but a 5xx means the app itself answered."""
+    url = 'http://{}:{}{}'.format(host, port, path)
+    try:
+        request.urlopen(url, timeout=5).close()
+    except error.HTTPError as e:
+        if e.code >= 500:
+            raise NotReady('{} returned {}'.format(url, e.code))
+    except (error.URLError, socket.error) as e:
+        raise NotReady('{}: {}'.format(url, e))
+
+
+def probe_mysql(unix_socket=MYSQL_SOCKET):
+    try:
+        conn = pymysql.connect(unix_socket=unix_socket, user='root',
+                               connect_timeout=5)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        finally:
+            conn.close()
+    except pymysql.MySQLError as e:
+        raise NotReady(str(e))
+
+
+def probe_amqp(host, port=5672):
+    """Send an AMQP 0-9-1 header and expect connection.start back."""
+    try:
+        sock = socket.create_connection((host, port), timeout=5)
+        try:
+            sock.sendall(b'AMQP\x00\x00\x09\x01')
+            frame = sock.recv(7)
+        finally:
+            sock.close()
+    except socket.error as e:
+        raise NotReady('{}:{}: {}'.format(host, port, e))
+    if len(frame) < 7 or struct.unpack('!B', frame[:1])[0] != 1:
+        raise NotReady('no connection.start from {}:{}'.format(host, port))
+
+
+class Inotify(object):
+    """Just enough of inotify(7) to wait on changes in one directory."""
+
+    def __init__(self, directory, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        if libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def wait(self, timeout):
+        """Block until some event arrives, or timeout seconds pass."""
+        try:
+            ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if ready:
+            os.read(self.fd, 4096)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _log_says_started(path):
+    try:
+        with open(path) as log:
+            content = log.read()
+    except IOError:
+        return False
+    return 'Starting broker...' in content and 'completed' in content
+
+
+def wait_rabbitmq_log(deadline, path=RABBITMQ_LOG):
+    """Wait for rabbitmq-server to log that the broker has started.
+
+    The wrapper truncates the log on every start, so its directory is
+    watched for the file being created or written to.
+    """
+    directory = os.path.dirname(path)
+    while not os.path.isdir(directory):
+        if time.time() > deadline:
+            raise NotReady('{} does not exist'.format(directory))
+        time.sleep(0.5)
+    watch = Inotify(directory, IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE |
+                    IN_MOVED_TO)
+    try:
+        while not _log_says_started(path):
+            if time.time() > deadline:
+                raise NotReady('broker start not logged in {}'.format(path))
+            watch.wait(deadline - time.time())
+    finally:
+        watch.close()
+
+
+def retry(probe, deadline, initial=0.1, factor=1.5, maximum=2.0):
+    """Call probe until it stops raising NotReady, backing off between."""
+    delay = initial
+    while True:
+        try:
+            return probe()
+        except NotReady:
+            if time.time() + delay > deadline:
+                raise
+        time.sleep(delay)
+        delay = min(delay * factor, maximum)
+
+
+def wait_for(service, host, deadline):
+    if service == 'mysql':
+        retry(probe_mysql, deadline)
+    elif service == 'rabbitmq':
+        wait_rabbitmq_log(deadline)
+        retry(lambda: probe_amqp(host), deadline)
+    else:
+        port, path = APIS[service]
+        retry(lambda: probe_api(host, port, path), deadline)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Wait until microstack services answer requests.')
+    parser.add_argument('services', nargs='*', metavar='service',
+                        help='services to wait for (default: all of {})'
+                             .format(', '.join(sorted(DEADLINES))))
+    parser.add_argument('--host', default='10.20.20.1',
+                        help='address the services listen on')
+    parser.add_argument('--timeout', type=float,
+                        help='override the per service deadline, in seconds')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the timings to FILE')
+    args = parser.parse_args()
+
+    services = args.services or sorted(DEADLINES)
+    for service in services:
+        if service not in DEADLINES:
+            parser.error('unknown service {}'.format(service))
+
+    timeline = timing.Timeline()
+    failed = []
+
+    def wait(service):
+        deadline = timeline.origin + (args.timeout or DEADLINES[service])
+        try:
+            with timeline.span(service, 'ready'):
+                wait_for(service, args.host, deadline)
+        except NotReady as e:
+            failed.append(service)
+            print('{} not ready: {}'.format(service, e), file=sys.stderr)
+
+    pool = futures.ThreadPoolExecutor(max_workers=len(services))
+    for job in [pool.submit(wait, service) for service in services]:
+        job.result()
+
+    timeline.report()
+    if args.json:
+        timeline.dump(args.json)
+    return 1 if failed else 0
@@ -0,0 +1,328 @@
+"""Reconcile a manifest of OpenStack resources against the live cloud.
+
+The manifest (see templates/manifest.yaml.j2) lists the projects,
+users, roles, services, endpoints, flavors, networks, subnets, routers
+and images a microstack should have. Live state is read with one bulk
+list call per resource type, and only what is missing is created.
+Independent creates run concurrently over a single keystone session.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+from concurrent import futures
+
+import yaml
+from six.moves.urllib import request
+
+from microstack import cloud
+from microstack import timing
+
+SECTIONS = ('identity', 'compute', 'network', 'image')
+INTERFACES = ('public', 'internal', 'admin')
+
+
+def _by_name(resources):
+    return dict((r['name'], r) for r in resources)
+
+
+class Reconciler(object):
+
+    def __init__(self, manifest, sess, timeline, workers=8):
+        self.manifest = manifest
+        self.session = sess
+        self.timeline = timeline
+        self.region = manifest.get('region', cloud.REGION)
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def _service(self, service_type):
+        return cloud.service(self.session, service_type, self.region)
+
+    def _each(self, fn, items):
+        """Call fn on every item concurrently, and wait for all of them."""
+        jobs = [self.executor.submit(fn, item) for item in items]
+        return [job.result() for job in jobs]
+
+    def _list(self, api, path, key):
+        with self.timeline.span('list {}'.format(key), 'list'):
+            return api.get(path).json()[key]
+
+    def _lists(self, api, *queries):
+        return self._each(lambda query: self._list(api, *query), queries)
+
+    def _create(self, api, path, key, body, label=None):
+        label = label or body.get('name', body.get('id'))
+        with self.timeline.span('create {} {}'.format(key, label), key):
+            return api.post(path, json={key: body}).json()[key]
+
+    def identity(self):
+        """Projects, roles, users, role assignments, services, endpoints.
+
+        Returns True if the service catalog changed.
+        """
+        keystone = self._service('identity')
+        projects, roles, users, assignments, services, endpoints, regions = \
+            self._lists(
+                keystone,
+                ('/projects?domain_id=default', 'projects'),
+                ('/roles', 'roles'),
+                ('/users?domain_id=default', 'users'),
+                ('/role_assignments', 'role_assignments'),
+                ('/services', 'services'),
+                ('/endpoints', 'endpoints'),
+                ('/regions', 'regions'))
+        projects, roles, users = (
+            _by_name(projects), _by_name(roles), _by_name(users))
+
+        if self.region not in [r['id'] for r in regions]:
+            self._create(keystone, '/regions', 'region', {'id': self.region})
+
+        def project(spec):
+            projects[spec['name']] = self._create(
+                keystone, '/projects', 'project', {
+                    'name': spec['name'],
+                    'domain_id': 'default',
+                    'description': spec.get('description', ''),
+                })
+
+        def role(name):
+            roles[name] = self._create(
+                keystone, '/roles', 'role', {'name': name})
+
+        def service(spec):
+            services.append(self._create(
+                keystone, '/services', 'service', {
+                    'name': spec['name'],
+                    'type': spec['type'],
+                    'description': spec.get('description', ''),
+                }))
+
+        wanted_roles = set(self.manifest.get('roles', []))
+        for spec in self.manifest.get('users', []):
+            wanted_roles.update(r['role'] for r in spec.get('roles', []))
+
+        existing_types = set(s['type'] for s in services)
+        self._each(lambda job: job[0](job[1]), (
+            [(project, p) for p in self.manifest.get('projects', [])
+             if p['name'] not in projects] +
+            [(role, r) for r in wanted_roles if r not in roles] +
+            [(service, s) for s in self.manifest.get('services', [])
+             if s['type'] not in existing_types]))
+
+        def user(spec):
+            users[spec['name']] = self._create(
+                keystone, '/users', 'user', {
+                    'name': spec['name'],
+                    'domain_id': 'default',
+                    'password': spec['password'],
+                })
+
+        self._each(user, [u for u in self.manifest.get('users', [])
+                          if u['name'] not in users])
+
+        granted = set(
+            (a['user']['id'], a['scope']['project']['id'], a['role']['id'])
+            for a in assignments
+            if 'user' in a and 'project' in a.get('scope', {}))
+
+        def grant(job):
+            user_id, project_id, role_id, label = job
+            with self.timeline.span('grant {}'.format(label), 'grant'):
+                keystone.put('/projects/{}/users/{}/roles/{}'.format(
+                    project_id, user_id, role_id))
+
+        grants = []
+        for spec in self.manifest.get('users', []):
+            for r in spec.get('roles', []):
+                ids = (users[spec['name']]['id'],
+                       projects[r['project']]['id'],
+                       roles[r['role']]['id'])
+                if ids not in granted:
+                    grants.append(ids + ('{} {} on {}'.format(
+                        r['role'], spec['name'], r['project']),))
+        self._each(grant, grants)
+
+        # Endpoints are keyed on (service, interface, region); an
+        # endpoint with a stale url is updated in place.
+        service_ids = dict((s['type'], s['id']) for s in services)
+        current = dict(
+            ((e['service_id'], e['interface'], e.get('region_id')), e)
+            for e in endpoints)
+
+        def endpoint(job):
+            service_id, interface, url, label = job
+            existing = current.get((service_id, interface, self.region))
+            if existing is None:
+                self._create(keystone, '/endpoints', 'endpoint', {
+                    'service_id': service_id,
+                    'interface': interface,
+                    'region_id': self.region,
+                    'url': url,
+                }, label)
+            else:
+                with self.timeline.span('update endpoint ' + label, 'endpoint'):
+                    keystone.patch('/endpoints/{}'.format(existing['id']),
+                                   json={'endpoint': {'url': url}})
+
+        jobs = []
+        for spec in self.manifest.get('services', []):
+            service_id = service_ids[spec['type']]
+            for interface in spec.get('interfaces', INTERFACES):
+                existing = current.get((service_id, interface, self.region))
+                if existing is None or existing['url'] != spec['url']:
+                    jobs.append((service_id, interface, spec['url'],
+                                 '{} {}'.format(spec['type'], interface)))
+        self._each(endpoint, jobs)
+        return bool(jobs)
+
+    def compute(self):
+        nova = self._service('compute')
+        flavors = _by_name(self._list(nova, '/flavors', 'flavors'))
+
+        def flavor(spec):
+            self._create(nova, '/flavors', 'flavor', {
+                'name': spec['name'],
+                'id': str(spec['id']),
+                'ram': spec['ram'],
+                'disk': spec['disk'],
+                'vcpus': spec['vcpus'],
+            })
+
+        self._each(flavor, [f for f in self.manifest.get('flavors', [])
+                            if f['name'] not in flavors])
+
+    def network(self):
+        neutron = self._service('network')
+        networks, subnets, routers, ports = self._lists(
+            neutron,
+            ('/v2.0/networks', 'networks'),
+            ('/v2.0/subnets', 'subnets'),
+            ('/v2.0/routers', 'routers'),
+            ('/v2.0/ports?device_owner=network:router_interface', 'ports'))
+        networks, subnets, routers = (
+            _by_name(networks), _by_name(subnets), _by_name(routers))
+
+        def network(spec):
+            body = {'name': spec['name']}
+            if spec.get('external'):
+                body['router:external'] = True
+            if 'provider' in spec:
+                body['provider:physical_network'] = \
+                    spec['provider']['physical_network']
+                body['provider:network_type'] = \
+                    spec['provider']['network_type']
+            networks[spec['name']] = self._create(
+                neutron, '/v2.0/networks', 'network', body)
+
+        def subnet(spec):
+            subnets[spec['name']] = self._create(
+                neutron, '/v2.0/subnets', 'subnet', {
+                    'name': spec['name'],
+                    'network_id': networks[spec['network']]['id'],
+                    'cidr': spec['cidr'],
+                    'ip_version': 4,
+                    'enable_dhcp': spec.get('dhcp', True),
+                })
+
+        attached = set(
+            (p['device_id'], ip['subnet_id'])
+            for p in ports for ip in p['fixed_ips'])
+
+        def router(spec):
+            if spec['name'] not in routers:
+                body = {'name': spec['name']}
+                if 'external_gateway' in spec:
+                    body['external_gateway_info'] = {
+                        'network_id': networks[spec['external_gateway']]['id']}
+                routers[spec['name']] = self._create(
+                    neutron, '/v2.0/routers', 'router', body)
+            router_id = routers[spec['name']]['id']
+            for name in spec.get('subnets', []):
+                subnet_id = subnets[name]['id']
+                if (router_id, subnet_id) in attached:
+                    continue
+                with self.timeline.span('attach {} to router {}'.format(
+                        name, spec['name']), 'router'):
+                    neutron.put(
+                        '/v2.0/routers/{}/add_router_interface'.format(
+                            router_id), json={'subnet_id': subnet_id})
+
+        self._each(network, [n for n in self.manifest.get('networks', [])
+                             if n['name'] not in networks])
+        self._each(subnet, [s for s in self.manifest.get('subnets', [])
+                            if s['name'] not in subnets])
+        self._each(router, self.manifest.get('routers', []))
+
+    def image(self):
+        glance = self._service('image')
+        images = _by_name(self._list(glance, '/v2/images?limit=1000', 'images'))
+
+        def image(spec):
+            path = spec['file']
+            if not os.path.exists(path):
+                with self.timeline.span('download ' + spec['url'], 'image'):
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    request.urlretrieve(spec['url'], path + '.part')
+                    os.rename(path + '.part', path)
+            with self.timeline.span('create image ' + spec['name'], 'image'):
+                created = glance.post('/v2/images', json={
+                    'name': spec['name'],
+                    'disk_format': spec.get('disk_format', 'qcow2'),
+                    'container_format': spec.get('container_format', 'bare'),
+                    'visibility': 'public' if spec.get('public') else 'private',
+                }).json()
+            with self.timeline.span('upload image ' + spec['name'], 'image'):
+                with open(path, 'rb') as data:
+                    glance.put(
+                        '/v2/images/{}/file'.format(created['id']), data=data,
+                        headers={'Content-Type': 'application/octet-stream'})
+
+        self._each(image, [i for i in self.manifest.get('images', [])
+                           if i['name'] not in images])
+
+    def run(self, sections=SECTIONS):
+        if 'identity' in sections and self.identity():
+            # The catalog is baked into the token, so pick up any new
+            # endpoints before talking to the services behind them.
+            self.session.auth.invalidate()
+        # Nova, Neutron and Glance don't depend on each other.
+        others = [getattr(self, s) for s in sections if s != 'identity']
+        pool = futures.ThreadPoolExecutor(max_workers=len(others) or 1)
+        for job in [pool.submit(section) for section in others]:
+            job.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Create the resources in a manifest that the local '
+                    'cloud does not have yet.')
+    parser.add_argument('manifest', help='path to the manifest yaml file')
+    parser.add_argument('--only', default=','.join(SECTIONS),
+                        help='comma separated sections to reconcile '
+                             '(default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='maximum number of concurrent API calls')
+    args = parser.parse_args()
+
+    sections = args.only.split(',')
+    for section in sections:
+        if section not in SECTIONS:
+            parser.error('unknown section {}'.format(section))
+
+    with open(args.manifest) as manifest:
+        manifest = yaml.safe_load(manifest)
+
+    timeline = timing.Timeline()
+    reconciler = Reconciler(manifest, cloud.session_from_env(), timeline,
+                            workers=args.workers)
+    try:
+        reconciler.run(sections)
+    finally:
+        timeline.report()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
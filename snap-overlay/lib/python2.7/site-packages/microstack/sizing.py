@@ -0,0 +1,244 @@
+"""Size the worker, process and thread counts of the services.
+
+Counts are worked out from the number of cpus and the amount of memory,
+according to a profile:
+
+    minimal  one worker per service, for small CI VMs.
+    laptop   half the cpus for APIs, a quarter for RPC services, at most 4.
+    server   all the cpus for APIs, half for RPC services, at most 32.
+    auto     (the default) picks one of the above from the hardware.
+
+The total is then scaled down, if need be, so that the workers fit in a
+quarter of the machine's memory. Single services can be pinned with
+snap config, e.g. "snap set microstack workers.novaconductor=2".
+
+The results are stored as snap config keys named <service>workers (and
+uwsgithreads), which the templates render. The listen backlog of the
+uwsgi apps (uwsgilisten) and nginx's worker_connections
+(nginxconnections) follow from them, as do MySQL's max_connections
+(mysqlconnections) and its buffer pool (mysqlbufferpool, in MB), which
+mysql-start-server writes into my.cnf. The connections are shared out
+as a database pool per process (<project>dbpool, plus
+<project>dboverflow when busy), so that together they stay under
+max_connections.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+from microstack import config
+
+PROFILES = {
+    # share of cpus for api and rpc services, most workers per service,
+    # and threads per uwsgi process.
+    'minimal': {'api': 0.0, 'rpc': 0.0, 'max': 1, 'threads': 1},
+    'laptop': {'api': 0.5, 'rpc': 0.25, 'max': 4, 'threads': 2},
+    'server': {'api': 1.0, 'rpc': 0.5, 'max': 32, 'threads': 4},
+}
+
+# service: (kind, what the count is used for)
+SERVICES = {
+    'keystone': ('api', 'keystone uwsgi processes'),
+    'placement': ('api', 'placement uwsgi processes'),
+    'horizon': ('api', 'horizon uwsgi processes'),
+    'cinder': ('api', 'cinder uwsgi processes'),
+    'novaapi': ('api', 'nova osapi_compute_workers'),
+    'novametadata': ('rpc', 'nova metadata_workers'),
+    'novaconductor': ('rpc', 'nova [conductor] workers'),
+    'novascheduler': ('rpc', 'nova [scheduler] workers'),
+    'neutronapi': ('api', 'neutron api_workers'),
+    'neutronrpc': ('rpc', 'neutron rpc_workers'),
+    'neutronmetadata': ('rpc', 'neutron metadata_workers'),
+}
+
+# The services that run as uwsgi apps behind nginx.
+UWSGI = ('keystone', 'placement', 'horizon', 'cinder')
+
+# Rough resident size of one python worker, and the share of memory
+# the workers together may use.
+WORKER_MB = 120
+MEMORY_SHARE = 0.25
+
+# Database connections one worker may hold (oslo.db keeps a pool of 5,
+# and overflows past it under load), and spare ones for the services
+# that aren't sized here: nova-compute, glance, the neutron agents and
+# the manage commands.
+DB_CONNECTIONS_PER_WORKER = 10
+DB_CONNECTIONS_SPARE = 100
+
+# The processes of each project that keep database pools, as sized
+# above, how many more run besides (neutron-server's parent), and how
+# many pools each keeps (nova's processes have one for the cell and one
+# for the API database). nova-compute goes through the conductor.
+# glance-api isn't sized here and runs a worker per cpu, so it gets a
+# small fixed pool, out of the spare connections.
+DB_PROCESSES = {
+    'keystone': (['keystone'], 0, 1),
+    'nova': (['novaapi', 'novametadata', 'novaconductor', 'novascheduler',
+              'placement'], 0, 2),
+    'neutron': (['neutronapi', 'neutronrpc'], 1, 1),
+}
+GLANCE_DB_POOL = (1, 2)
+
+# The share of memory for MySQL's buffer pool, and its bounds in MB.
+MYSQL_MEMORY_SHARE = 0.1
+MYSQL_BUFFER_POOL_MB = (128, 4096)
+
+
+def hardware():
+    """Return the number of online cpus and the total memory in MB."""
+    cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+    with open('/proc/meminfo') as meminfo:
+        for line in meminfo:
+            if line.startswith('MemTotal:'):
+                return cpus, int(line.split()[1]) // 1024
+    raise RuntimeError('MemTotal missing from /proc/meminfo')
+
+
+def somaxconn():
+    """Return the most a listen backlog may be."""
+    try:
+        with open('/proc/sys/net/core/somaxconn') as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        return 128
+
+
+def pick_profile(cpus, memory_mb):
+    if cpus <= 2 or memory_mb < 8 * 1024:
+        return 'minimal'
+    if cpus >= 16 and memory_mb >= 32 * 1024:
+        return 'server'
+    return 'laptop'
+
+
+def size(cpus, memory_mb, profile='auto', overrides=None):
+    """Return the worker count per service, and the uwsgi thread count."""
+    if profile == 'auto':
+        profile = pick_profile(cpus, memory_mb)
+    if profile not in PROFILES:
+        raise ValueError('unknown workerprofile {}, should be one of '
+                         '{}'.format(profile, ', '.join(
+                             ['auto'] + sorted(PROFILES))))
+    shares = PROFILES[profile]
+    workers = {}
+    for service, (kind, _) in SERVICES.items():
+        workers[service] = max(1, min(int(cpus * shares[kind]),
+                                      shares['max']))
+
+    budget = int(memory_mb * MEMORY_SHARE // WORKER_MB)
+    total = sum(workers.values())
+    if total > budget:
+        for service in workers:
+            workers[service] = max(1, workers[service] * budget // total)
+
+    for service, count in (overrides or {}).items():
+        if service not in SERVICES:
+            raise ValueError('unknown service workers.{}, should be one '
+                             'of {}'.format(service, ', '.join(
+                                 sorted(SERVICES))))
+        workers[service] = int(count)
+    return workers, shares['threads']
+
+
+def connections(workers, threads, backlog_max):
+    """Return the uwsgi listen backlog, and nginx's worker_connections.
+
+    Requests that no uwsgi thread is free for wait in the backlog, so it
+    is sized from the processes, within what the kernel allows. nginx
+    holds two connections, client and upstream, for each request that
+    is running or waiting, and keeps some spare for static files.
+    """
+    listen = min(backlog_max,
+                 max(100, 16 * threads * max(workers[s] for s in UWSGI)))
+    in_flight = sum(workers[s] * threads + listen for s in UWSGI)
+    return listen, max(768, 2 * in_flight + 512)
+
+
+def mysql(workers, memory_mb):
+    """Return MySQL's max_connections, and its buffer pool in MB."""
+    max_connections = (DB_CONNECTIONS_PER_WORKER * sum(workers.values()) +
+                       DB_CONNECTIONS_SPARE)
+    low, high = MYSQL_BUFFER_POOL_MB
+    buffer_pool = max(low, min(high, int(memory_mb * MYSQL_MEMORY_SHARE)))
+    return max_connections, buffer_pool
+
+
+def db_pools(workers, max_connections):
+    """Return the database pool and overflow of each project's processes.
+
+    Every pool gets the same share of the connections left once the
+    spare ones are set aside, half of it kept open and half opened only
+    when busy.
+    """
+    count = sum((sum(workers[s] for s in services) + extra) * engines
+                for services, extra, engines in DB_PROCESSES.values())
+    share = max(2, (max_connections - DB_CONNECTIONS_SPARE) // count)
+    pools = dict((project, (share // 2, share - share // 2))
+                 for project in DB_PROCESSES)
+    pools['glance'] = GLANCE_DB_POOL
+    return pools
+
+
+def snap_keys(workers, threads, memory_mb, backlog_max=128):
+    keys = dict(('{}workers'.format(s), n) for s, n in workers.items())
+    keys['uwsgithreads'] = threads
+    keys['uwsgilisten'], keys['nginxconnections'] = connections(
+        workers, threads, backlog_max)
+    keys['mysqlconnections'], keys['mysqlbufferpool'] = mysql(
+        workers, memory_mb)
+    for project, (pool, overflow) in db_pools(
+            workers, keys['mysqlconnections']).items():
+        keys['{}dbpool'.format(project)] = pool
+        keys['{}dboverflow'.format(project)] = overflow
+    return keys
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Work out worker counts for the services from the '
+                    'hardware, the workerprofile and workers.* snap config.')
+    parser.add_argument('action', nargs='?', default='show',
+                        choices=['show', 'apply'],
+                        help='show the sizing (default), or apply it to '
+                             'the snap config the templates are rendered '
+                             'from (hooks only)')
+    args = parser.parse_args()
+
+    cpus, memory_mb = hardware()
+    profile = config.get('workerprofile', 'auto')
+    overrides = config.get('workers', {})
+    try:
+        workers, threads = size(cpus, memory_mb, profile, overrides)
+    except ValueError as e:
+        print('Cannot size the services: {}'.format(e), file=sys.stderr)
+        return 1
+    keys = snap_keys(workers, threads, memory_mb, somaxconn())
+
+    if args.action == 'apply':
+        config.set(keys)
+        return 0
+
+    if profile == 'auto':
+        profile = 'auto ({})'.format(pick_profile(cpus, memory_mb))
+    print('{} cpus, {} MB memory, profile {}'.format(cpus, memory_mb, profile))
+    print('{:<16} {:>7} {:>8}  {}'.format(
+        'service', 'workers', 'applied', 'used for'))
+    for service in sorted(SERVICES):
+        applied = config.get('{}workers'.format(service), '-')
+        print('{:<16} {:>7} {:>8}  {}{}'.format(
+            service, workers[service], applied, SERVICES[service][1],
+            ' (override)' if service in overrides else ''))
+    print('uwsgi threads per process: {}, listen backlog: {}'.format(
+        threads, keys['uwsgilisten']))
+    print('nginx worker connections: {}'.format(keys['nginxconnections']))
+    print('mysql max connections: {}, buffer pool: {} MB'.format(
+        keys['mysqlconnections'], keys['mysqlbufferpool']))
+    print('database pool per process: {}'.format(', '.join(
+        '{} {}+{}'.format(p, keys[p + 'dbpool'], keys[p + 'dboverflow'])
+        for p in sorted(list(DB_PROCESSES) + ['glance']))))
+    print('about {} MB for {} workers'.format(
+        sum(workers.values()) * WORKER_MB, sum(workers.values())))
+    return 0
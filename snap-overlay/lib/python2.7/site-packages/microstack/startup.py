@@ -0,0 +1,323 @@
+"""Trace how long each daemon takes to start.
+
+The daemons are started through bin/traced, which records when systemd
+started the unit and when the launcher ran, then leaves a watcher
+behind and execs the daemon in its place. The watcher follows the
+processes in the unit's cgroup, and records when snap-openstack has
+handed over to the service itself, when the service first connects to
+the database and to RabbitMQ, and when it first listens on a socket.
+
+Events go to $SNAP_COMMON/log/startup/<unit>.jsonl, one file per unit,
+started afresh whenever the unit is. "microstack.trace-startup" merges
+them into a Chrome trace (chrome://tracing, or ui.perfetto.dev), and
+prints the critical path.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from microstack import timing
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+TRACE_DIR = os.path.join(SNAP_COMMON, 'log/startup')
+
+# Give up watching after this long, and keep watching this long after
+# the service is ready, in case it connects to something else.
+WATCH_SECONDS = 600
+SETTLE_SECONDS = 10
+INTERVAL = 0.1
+
+# Ports a service connects to, or listens on, that other units wait for.
+PORTS = {
+    3306: 'database',
+    5672: 'amqp',
+}
+
+# What the time leading up to each event was spent on.
+PHASES = {
+    'launcher': 'snap run',
+    'exec': 'snap-openstack (templates, config)',
+    'database connected': 'until database connected',
+    'amqp connected': 'until amqp connected',
+    'listening': 'until listening',
+    'database listening': 'until database listening',
+    'amqp listening': 'until amqp listening',
+}
+
+READY = ('listening', 'amqp connected')
+
+TCP_LISTEN = '0A'
+TCP_ESTABLISHED = '01'
+UNIX_ACCEPTCON = 0x10000
+
+
+def boot_time():
+    with open('/proc/stat') as stat:
+        for line in stat:
+            if line.startswith('btime '):
+                return int(line.split()[1])
+
+
+def process_start(pid):
+    """When the process was forked, as a unix timestamp."""
+    with open('/proc/{}/stat'.format(pid)) as stat:
+        # The command can have spaces in it, but not a ')'.
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return boot_time() + float(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+
+def unit_cgroup():
+    """The unit's cgroup.procs file, or None if we can't find it."""
+    with open('/proc/self/cgroup') as cgroups:
+        for line in cgroups:
+            _, controllers, path = line.strip().split(':', 2)
+            if controllers == 'name=systemd':
+                procs = '/sys/fs/cgroup/systemd{}/cgroup.procs'.format(path)
+            elif controllers == '':
+                procs = '/sys/fs/cgroup{}/cgroup.procs'.format(path)
+            else:
+                continue
+            if path.endswith('.service') and os.path.exists(procs):
+                return procs
+
+
+def unit_name(argv):
+    procs = unit_cgroup()
+    if procs:
+        # .../snap.microstack.nova-compute.service/cgroup.procs
+        return os.path.basename(os.path.dirname(procs)).split('.')[-2]
+    if 'snap-openstack' in argv[0] and len(argv) > 2:
+        return argv[2]
+    return os.path.basename(argv[0])
+
+
+def unit_pids(procs, main_pid):
+    if not procs:
+        return [main_pid]
+    try:
+        with open(procs) as f:
+            return [int(pid) for pid in f.read().split()
+                    if int(pid) != os.getpid()]
+    except (IOError, ValueError):
+        return [main_pid]
+
+
+def socket_inodes(pids):
+    inodes = set()
+    for pid in pids:
+        try:
+            fds = os.listdir('/proc/{}/fd'.format(pid))
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink('/proc/{}/fd/{}'.format(pid, fd))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                inodes.add(target[8:-1])
+    return inodes
+
+
+def socket_events(inodes):
+    """Events for the listening and connected sockets among inodes."""
+    events = set()
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if fields[9] not in inodes:
+                continue
+            local = int(fields[1].rsplit(':', 1)[1], 16)
+            remote = int(fields[2].rsplit(':', 1)[1], 16)
+            if fields[3] == TCP_LISTEN:
+                events.add('listening')
+                if local in PORTS:
+                    events.add(PORTS[local] + ' listening')
+            elif fields[3] == TCP_ESTABLISHED and remote in PORTS:
+                events.add(PORTS[remote] + ' connected')
+    try:
+        with open('/proc/net/unix') as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if (len(fields) > 6 and fields[6] in inodes and
+                        int(fields[3], 16) & UNIX_ACCEPTCON):
+                    events.add('listening')
+    except IOError:
+        pass
+    return events
+
+
+def cmdline(pid):
+    try:
+        with open('/proc/{}/cmdline'.format(pid)) as f:
+            return f.read()
+    except IOError:
+        return ''
+
+
+class Recorder(object):
+
+    def __init__(self, unit):
+        if not os.path.isdir(TRACE_DIR):
+            os.makedirs(TRACE_DIR)
+        self.unit = unit
+        self.path = os.path.join(TRACE_DIR, unit + '.jsonl')
+        open(self.path, 'w').close()
+        self.seen = set()
+
+    def record(self, event, when=None):
+        if event in self.seen:
+            return
+        self.seen.add(event)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'unit': self.unit, 'event': event,
+                                'time': when or time.time()}) + '\n')
+
+
+def watch(recorder, main_pid, launched_openstack):
+    procs = unit_cgroup()
+    deadline = time.time() + WATCH_SECONDS
+    while time.time() < deadline:
+        if not os.path.exists('/proc/{}'.format(main_pid)) and not procs:
+            return
+        if (launched_openstack and 'exec' not in recorder.seen and
+                'snap-openstack' not in cmdline(main_pid)):
+            recorder.record('exec')
+        pids = unit_pids(procs, main_pid)
+        if not pids:
+            return
+        for event in sorted(socket_events(socket_inodes(pids))):
+            recorder.record(event)
+        ready = [e for e in READY if e in recorder.seen]
+        if ready:
+            deadline = min(deadline, time.time() + SETTLE_SECONDS)
+        time.sleep(INTERVAL)
+
+
+def launch(argv):
+    """Record the start of the unit, fork a watcher and exec argv.
+
+    Tracing must never keep a daemon from starting, so any error in it
+    is ignored.
+    """
+    try:
+        launched = time.time()
+        main_pid = os.getpid()
+        recorder = Recorder(unit_name(argv))
+        recorder.record('started', process_start(main_pid))
+        recorder.record('launcher', launched)
+        child = os.fork()
+        if child == 0:
+            # Detach, so that the daemon doesn't have a child to reap.
+            os.setsid()
+            if os.fork() == 0:
+                try:
+                    devnull = os.open(os.devnull, os.O_RDWR)
+                    for fd in (0, 1, 2):
+                        os.dup2(devnull, fd)
+                    watch(recorder, main_pid, 'snap-openstack' in argv[0])
+                finally:
+                    os._exit(0)
+            os._exit(0)
+        os.waitpid(child, 0)
+    except Exception as e:
+        print('Not tracing startup: {}'.format(e), file=sys.stderr)
+    os.execvp(argv[0], argv)
+
+
+def load(trace_dir=TRACE_DIR):
+    """Return the events of each unit, in order."""
+    units = {}
+    for path in glob.glob(os.path.join(trace_dir, '*.jsonl')):
+        with open(path) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        if events:
+            units[events[0]['unit']] = sorted(
+                events, key=lambda e: e['time'])
+    return units
+
+
+def ready_time(events):
+    times = [e['time'] for e in events if e['event'] in READY]
+    return min(times) if times else events[-1]['time']
+
+
+def critical_path(units):
+    """The unit that was ready last, and the units it waited on.
+
+    A unit is taken to have waited on mysqld or rabbitmq-server when it
+    connected to them shortly after they started listening.
+    """
+    path = []
+    unit = max(units, key=lambda u: ready_time(units[u]))
+    while unit and unit not in path:
+        path.insert(0, unit)
+        times = dict((e['event'], e['time']) for e in units[unit])
+        waited = None
+        for kind in PORTS.values():
+            for other, events in units.items():
+                if other == unit:
+                    continue
+                listening = dict((e['event'], e['time']) for e in events).get(
+                    kind + ' listening')
+                connected = times.get(kind + ' connected')
+                if (listening and connected and
+                        0 <= connected - listening < 2):
+                    waited = other
+        unit = waited
+    return path
+
+
+def timeline(units):
+    line = timing.Timeline()
+    line.origin = min(events[0]['time'] for events in units.values())
+    for unit, events in units.items():
+        for before, event in zip(events, events[1:]):
+            line.add(PHASES.get(event['event'], event['event']),
+                     before['time'], event['time'], unit)
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarise how long the daemons took to start, from the '
+                    'traces they left in {}.'.format(TRACE_DIR))
+    parser.add_argument('-o', '--output',
+                        help='write a Chrome trace (for chrome://tracing or '
+                             'ui.perfetto.dev) here')
+    args = parser.parse_args()
+
+    units = load()
+    if not units:
+        print('No startup traces in {}'.format(TRACE_DIR))
+        return 1
+    line = timeline(units)
+    origin = line.origin
+
+    print('{:<28} {:>9} {:>9}'.format('unit', 'started', 'ready'))
+    for unit in sorted(units, key=lambda u: ready_time(units[u])):
+        print('{:<28} {:>8.2f}s {:>8.2f}s'.format(
+            unit, units[unit][0]['time'] - origin,
+            ready_time(units[unit]) - origin))
+
+    print('\nCritical path:')
+    for unit in critical_path(units):
+        for span in line.spans:
+            if span['category'] == unit:
+                print('{:8.2f}s {:8.2f}s  {}: {}'.format(
+                    span['start'], span['duration'], unit, span['name']))
+
+    if args.output:
+        line.dump_chrome(args.output)
+        print('\nWrote {}'.format(args.output))
+    return 0
@@ -0,0 +1,72 @@
+"""Wall clock timings for the microstack commands.
+
+A Timeline collects named spans from any number of threads, so that
+commands doing work concurrently can still print where the time went.
+"""
+from __future__ import print_function
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+
+class Timeline(object):
+    """Named spans, with start times relative to the timeline's creation."""
+
+    def __init__(self):
+        self.origin = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, category='default'):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), category)
+
+    def add(self, name, start, end, category='default'):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'category': category,
+                'start': start - self.origin,
+                'duration': end - start,
+            })
+
+    def elapsed(self):
+        return time.time() - self.origin
+
+    def report(self, out=sys.stdout):
+        """Print one line per span, ordered by start time."""
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            print('{:8.2f}s {:8.2f}s  {}'.format(
+                span['start'], span['duration'], span['name']), file=out)
+        print('{:8.2f}s total'.format(self.elapsed()), file=out)
+
+    def dump(self, path):
+        with open(path, 'w') as out:
+            json.dump({'total': self.elapsed(), 'spans': self.spans},
+                      out, indent=2, sort_keys=True)
+
+    def dump_chrome(self, path):
+        """Write the spans as a Chrome trace, one row per category."""
+        rows = sorted(set(span['category'] for span in self.spans))
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                   'tid': tid, 'args': {'name': row}}
+                  for tid, row in enumerate(rows)]
+        for span in self.spans:
+            events.append({
+                'name': span['name'],
+                'cat': span['category'],
+                'ph': 'X',
+                'pid': 1,
+                'tid': rows.index(span['category']),
+                'ts': int(span['start'] * 1e6),
+                'dur': int(span['duration'] * 1e6),
+            })
+        with open(path, 'w') as out:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, out)
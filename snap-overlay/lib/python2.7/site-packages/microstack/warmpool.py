@@ -0,0 +1,382 @@
+"""Keep instances booted ahead of time, for microstack.launch to hand out.
+
+The warmpool daemon keeps "snap get microstack warmpool" instances of
+the warmpoolflavor flavor and warmpoolimage image booted, each with a
+floating ip and booted far enough to answer on ssh. They are named
+warmpool-<id>, and carry the metadata microstack-pool=booting|ready, so
+the pool survives a restart of the daemon.
+
+microstack.launch asks the daemon for one over a unix socket, sending
+the name it wants and the public key of its keypair. The daemon puts
+the key in the instance's authorized_keys over ssh (the pool boots with
+a keypair of its own), renames it, takes it out of the pool and answers
+with its id and floating ip. Then it boots a replacement.
+
+Idle instances still use some CPU. When the ready instances together
+use more than warmpoolcpu percent of one cpu, the busiest ones are
+paused, and unpaused when handed out.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+from keystoneauth1 import exceptions
+from six.moves import socketserver
+from six.moves.urllib import parse
+
+from microstack import cloud
+from microstack import config
+
+SNAP_COMMON = os.environ.get('SNAP_COMMON', '/var/snap/microstack/common')
+SOCKET = os.path.join(SNAP_COMMON, 'run/warmpool.sock')
+KEY_FILE = os.path.join(SNAP_COMMON, 'lib/warmpool/id_pool')
+KEY_NAME = 'microstack-pool'
+PREFIX = 'warmpool-'
+METADATA = 'microstack-pool'
+LOGIN_USER = 'cirros'
+NETWORK = 'test'
+EXTERNAL = 'external'
+
+# Seconds between looks at the pool, and over which CPU use is sampled.
+INTERVAL = 10
+BOOT_TIMEOUT = 600
+
+SSH = ['ssh', '-i', KEY_FILE, '-o', 'BatchMode=yes',
+       '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+       '-o', 'ConnectTimeout=5', '-o', 'LogLevel=ERROR']
+
+
+def settings():
+    """The pool's snap config: size, flavor, image and cpu budget."""
+    return {
+        'size': int(config.get('warmpool', 0)),
+        'flavor': config.get('warmpoolflavor', 'm1.tiny'),
+        'image': config.get('warmpoolimage', 'cirros'),
+        'cpu': float(config.get('warmpoolcpu', 10)),
+    }
+
+
+def ssh_banner(ip, deadline):
+    """Wait until sshd on ip says hello, i.e. the guest has booted."""
+    while time.time() < deadline:
+        try:
+            sock = socket.create_connection((ip, 22), timeout=2)
+            try:
+                if sock.recv(4).startswith(b'SSH-'):
+                    return True
+            finally:
+                sock.close()
+        except socket.error:
+            pass
+        time.sleep(1)
+    return False
+
+
+class Pool(object):
+
+    def __init__(self, sess):
+        self.session = sess
+        self.nova = cloud.service(sess, 'compute')
+        self.neutron = cloud.service(sess, 'network')
+        self.glance = cloud.service(sess, 'image')
+        self.lock = threading.Lock()
+        self.refill = threading.Event()
+        self.settings = settings()
+        self.cpu_times = {}  # server id: (time, cpu seconds)
+        self.emptied = False  # Whether the pool is off, and empty.
+
+    def _id(self, api, path, key, name):
+        found = [r for r in api.get(path).json()[key]
+                 if name in (r['name'], r['id'])]
+        return found[0]['id'] if found else None
+
+    def ensure_keypair(self):
+        try:
+            self.nova.get('/os-keypairs/' + KEY_NAME)
+            if os.path.exists(KEY_FILE):
+                return
+            self.nova.delete('/os-keypairs/' + KEY_NAME)
+        except exceptions.NotFound:
+            pass
+        keypair = self.nova.post('/os-keypairs', json={
+            'keypair': {'name': KEY_NAME}}).json()['keypair']
+        directory = os.path.dirname(KEY_FILE)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as key_file:
+            key_file.write(keypair['private_key'])
+
+    def servers(self):
+        """The pool's servers, with their state and floating ip."""
+        servers = self.nova.get('/servers/detail?name=' + parse.quote(
+            '^' + PREFIX)).json()['servers']
+        pool = []
+        for server in servers:
+            state = server.get('metadata', {}).get(METADATA)
+            if not state:
+                continue
+            server['pool'] = state
+            server['ip'] = None
+            for addresses in server['addresses'].values():
+                for address in addresses:
+                    if address.get('OS-EXT-IPS:type') == 'floating':
+                        server['ip'] = address['addr']
+            pool.append(server)
+        return pool
+
+    def matches(self, request):
+        return (request.get('flavor') == self.settings['flavor'] and
+                request.get('image') == self.settings['image'] and
+                request.get('network', NETWORK) == NETWORK and
+                request.get('external', EXTERNAL) == EXTERNAL)
+
+    def boot(self):
+        """Boot one instance into the pool, and wait for it to be ready.
+
+        Returns whether it is.
+        """
+        name = PREFIX + uuid.uuid4().hex[:8]
+        ids = {
+            'flavor': self._id(self.nova, '/flavors', 'flavors',
+                               self.settings['flavor']),
+            'image': self._id(self.glance, '/v2/images?name=' +
+                              self.settings['image'], 'images',
+                              self.settings['image']),
+            'network': self._id(self.neutron, '/v2.0/networks?name=' +
+                                NETWORK, 'networks', NETWORK),
+            'external': self._id(self.neutron, '/v2.0/networks?name=' +
+                                 EXTERNAL, 'networks', EXTERNAL),
+        }
+        missing = sorted(key for key, value in ids.items() if not value)
+        if missing:
+            print('Not filling the pool, missing ' + ', '.join(missing))
+            return False
+        server = self.nova.post('/servers', json={'server': {
+            'name': name,
+            'flavorRef': ids['flavor'],
+            'imageRef': ids['image'],
+            'key_name': KEY_NAME,
+            'networks': [{'uuid': ids['network']}],
+            'metadata': {METADATA: 'booting'},
+        }}).json()['server']
+        deadline = time.time() + BOOT_TIMEOUT
+        while True:
+            status = self.nova.get(
+                '/servers/' + server['id']).json()['server']['status']
+            if status == 'ACTIVE':
+                break
+            if status != 'BUILD' or time.time() > deadline:
+                print('{} went to {}'.format(name, status))
+                self.nova.delete('/servers/' + server['id'])
+                return False
+            time.sleep(1)
+        port = self.neutron.get(
+            '/v2.0/ports?device_id=' + server['id']).json()['ports'][0]
+        fip = self.neutron.post('/v2.0/floatingips', json={'floatingip': {
+            'floating_network_id': ids['external'],
+            'port_id': port['id']}}).json()['floatingip']
+        if not ssh_banner(fip['floating_ip_address'], deadline):
+            print('{} did not answer on ssh'.format(name))
+            self.delete(server['id'])
+            return False
+        self.nova.put('/servers/{}/metadata/{}'.format(server['id'], METADATA),
+                      json={'meta': {METADATA: 'ready'}})
+        print('{} ready, floating ip {}'.format(
+            name, fip['floating_ip_address']))
+        return True
+
+    def wait_active(self, server_id, timeout=30):
+        deadline = time.time() + timeout
+        while self.nova.get('/servers/' + server_id).json()['server'][
+                'status'] != 'ACTIVE':
+            if time.time() > deadline:
+                raise OSError('still not ACTIVE after {}s'.format(timeout))
+            time.sleep(0.2)
+
+    def delete(self, server_id):
+        ports = self.neutron.get(
+            '/v2.0/ports?device_id=' + server_id).json()['ports']
+        for port in ports:
+            for fip in self.neutron.get(
+                    '/v2.0/floatingips?port_id=' + port['id']
+            ).json()['floatingips']:
+                self.neutron.delete('/v2.0/floatingips/' + fip['id'])
+        self.nova.delete('/servers/' + server_id)
+
+    def cpu_seconds(self, server_id):
+        diagnostics = self.nova.get(
+            '/servers/{}/diagnostics'.format(server_id)).json()
+        return sum(value for key, value in diagnostics.items()
+                   if re.match(r'cpu\d+_time$', key)) / 1e9
+
+    def enforce_cpu(self, ready):
+        """Pause the busiest ready instances while over the budget."""
+        usage = {}
+        now = time.time()
+        for server in ready:
+            if server['status'] != 'ACTIVE':
+                continue
+            try:
+                seconds = self.cpu_seconds(server['id'])
+            except exceptions.ClientException:
+                continue
+            before = self.cpu_times.get(server['id'])
+            self.cpu_times[server['id']] = (now, seconds)
+            if before and now > before[0]:
+                usage[server['id']] = (
+                    100 * (seconds - before[1]) / (now - before[0]))
+        total = sum(usage.values())
+        for server_id in sorted(usage, key=usage.get, reverse=True):
+            if total <= self.settings['cpu']:
+                break
+            self.nova.post('/servers/{}/action'.format(server_id),
+                           json={'pause': None})
+            total -= usage.pop(server_id)
+            del self.cpu_times[server_id]
+
+    def tend(self):
+        """Bring the pool to its size, and under its cpu budget.
+
+        Returns whether an instance was added, i.e. whether to carry on
+        straight away.
+        """
+        self.settings = settings()
+        if not self.settings['size'] and self.emptied:
+            return False
+        with self.lock:
+            pool = self.servers()
+            # Instances are booted one at a time, in this thread, so any
+            # still booting were left behind by an earlier run.
+            for server in [s for s in pool if s['pool'] == 'booting']:
+                self.delete(server['id'])
+                pool.remove(server)
+            ready = [s for s in pool if s['pool'] == 'ready']
+            extra = len(pool) - self.settings['size']
+            for server in ready[:max(extra, 0)]:
+                self.delete(server['id'])
+                ready.remove(server)
+            self.enforce_cpu(ready)
+        self.emptied = not self.settings['size']
+        if len(pool) < self.settings['size']:
+            self.ensure_keypair()
+            # Or no instance would answer ssh_banner before its timeout.
+            cloud.allow_ping_and_ssh(self.neutron,
+                                     self.session.get_project_id())
+            return self.boot()
+        return False
+
+    def claim(self, request):
+        """Hand a ready instance out, re-keyed and renamed."""
+        if not self.matches(request):
+            return {'error': 'the pool has {flavor} {image} instances'.format(
+                **self.settings)}
+        with self.lock:
+            ready = [s for s in self.servers()
+                     if s['pool'] == 'ready' and s['ip']]
+            if not ready:
+                return {'error': 'no instances ready'}
+            server = ready[0]
+            if server['status'] == 'PAUSED':
+                self.nova.post('/servers/{}/action'.format(server['id']),
+                               json={'unpause': None})
+            self.nova.delete('/servers/{}/metadata/{}'.format(
+                server['id'], METADATA))
+            self.cpu_times.pop(server['id'], None)
+        self.refill.set()
+        try:
+            if server['status'] == 'PAUSED':
+                self.wait_active(server['id'])
+            rekey = subprocess.Popen(
+                SSH + ['{}@{}'.format(LOGIN_USER, server['ip']),
+                       'umask 077; mkdir -p .ssh; '
+                       'cat > .ssh/authorized_keys'],
+                stdin=subprocess.PIPE)
+            rekey.communicate(request['public_key'].encode())
+            if rekey.returncode != 0:
+                raise OSError('ssh exited with {}'.format(rekey.returncode))
+            self.nova.put('/servers/' + server['id'], json={
+                'server': {'name': request['name']}})
+        except (OSError, exceptions.ClientException) as e:
+            self.delete(server['id'])
+            return {'error': 'could not re-key {}: {}'.format(
+                server['name'], e)}
+        return {'id': server['id'], 'ip': server['ip']}
+
+    def run(self):
+        while True:
+            try:
+                busy = self.tend()
+            except exceptions.ClientException as e:
+                print('Could not tend the pool: {}'.format(e))
+                busy = False
+            if not busy:
+                self.refill.wait(INTERVAL)
+                self.refill.clear()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def handler(pool):
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            try:
+                answer = pool.claim(json.loads(self.rfile.readline()))
+            except Exception as e:
+                answer = {'error': str(e)}
+            self.wfile.write((json.dumps(answer) + '\n').encode())
+
+    return Handler
+
+
+def claim(name, flavor, image, network, external, public_key, timeout=60):
+    """Ask the daemon for an instance; None if there is none to have.
+
+    Returns the server's id and floating ip.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(SOCKET)
+        sock.sendall((json.dumps({
+            'name': name, 'flavor': flavor, 'image': image,
+            'network': network, 'external': external,
+            'public_key': public_key}) + '\n').encode())
+        answer = json.loads(sock.makefile().readline())
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
+    if 'error' in answer:
+        return None
+    return answer['id'], answer['ip']
+
+
+def main():
+    argparse.ArgumentParser(
+        description='Keep instances booted for microstack.launch to hand '
+                    'out. Sized with "snap set microstack warmpool=N".'
+    ).parse_args()
+
+    pool = Pool(cloud.session_from_env())
+    if os.path.exists(SOCKET):
+        os.unlink(SOCKET)
+    server = Server(SOCKET, handler(pool))
+    # microstack.launch runs as the user.
+    os.chmod(SOCKET, 0o666)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    pool.run()
@@ -1,4 +1,5 @@
 # Tweaks to make this run nicely in a snap.
+import os
 
 # We don't want django to try writing the secret key before we've told
 # it not to attempt to write it out in the read only snap dir in our
@@ -6,10 +7,11 @@
 # settings.py here.
 SECRET_KEY = "overridethis!"
 
-# Django wants to write out compressed files even when we turn
-# compression off (either a bug or something that I'm not
-# understanding). Tell it to write them some place writeable.
-STATIC_ROOT = '/var/snap/microstack/common/var/horizon/static'
+# Static files are collected, and compressed offline, when the snap is
+# built (see the horizon-static part in snapcraft.yaml), which sets
+# HORIZON_STATIC_ROOT to put them in the snap. nginx serves them.
+STATIC_ROOT = os.environ.get('HORIZON_STATIC_ROOT',
+                             '/snap/microstack/current/static/horizon')
 
 # Disable extra themes for now. TODO: Re-enable when
 # https://github.com/CanonicalLtd/microstack/issues/39 is
@@ -0,0 +1,10 @@
+# Settings rendered by snap-openstack from the templates, so that they
+# can follow snap config. This dir is read only, so the rendered
+# snippets live in $SNAP_COMMON, and are loaded here in the same way
+# as the ones in this dir.
+import glob as _glob
+
+for _snippet in sorted(_glob.glob(
+        '/var/snap/microstack/common/etc/horizon/local_settings.d/*.py')):
+    with open(_snippet) as _f:
+        exec(_f.read())
@@ -8,18 +8,20 @@ from horizon.utils import secret_key
 
 from openstack_dashboard.settings import HORIZON_CONFIG
 
-DEBUG = True
+DEBUG = False
 
 # This setting controls whether or not compression is enabled. Disabling
 # compression makes Horizon considerably slower, but makes it much easier
 # to debug JS and CSS changes
-#COMPRESS_ENABLED = not DEBUG
+COMPRESS_ENABLED = not DEBUG
 
 # This setting controls whether compression happens on the fly, or offline
 # with `python manage.py compress`
 # See https://django-compressor.readthedocs.io/en/latest/usage/#offline-compression
 # for more information
-#COMPRESS_OFFLINE = not DEBUG
+# The snap's static files are compressed when it is built, by the
+# horizon-static part in snapcraft.yaml.
+COMPRESS_OFFLINE = not DEBUG
 
 # WEBROOT is the location relative to Webserver root
 # should end with a slash.
@@ -161,6 +163,8 @@ SECRET_KEY = secret_key.generate_or_read_from_file(
 #    },
 #}
 
+# In the snap, CACHES is set from snap config by the _10_cache.py snippet
+# rendered from templates/horizon.local_settings.d._10_cache.py.j2.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
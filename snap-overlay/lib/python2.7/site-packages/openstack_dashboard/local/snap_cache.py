@@ -0,0 +1,128 @@
+# Cache the results of Horizon API lookups that rarely change.
+#
+# Horizon's own @memoized only lasts as long as the request it was
+# called with, so every page asks nova, neutron and cinder again which
+# extensions they support, and asks for quotas again. Here those
+# lookups go through Django's cache (memcached, in the snap), with a
+# TTL, and are shared between all horizon workers.
+#
+# Only results that pickle cleanly are cached: extension checks return
+# booleans and quota lookups return plain QuotaSets. Quota updates
+# drop the cached quotas for the project.
+
+import functools
+import hashlib
+import importlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest
+
+LOG = logging.getLogger(__name__)
+
+# module: {function: ttl}
+CACHED = {
+    'openstack_dashboard.api.nova': {
+        'extension_supported': 'extensions',
+        'tenant_quota_get': 'quotas',
+        'default_quota_get': 'quotas',
+    },
+    'openstack_dashboard.api.neutron': {
+        'is_extension_supported': 'extensions',
+        'tenant_quota_get': 'quotas',
+    },
+    'openstack_dashboard.api.cinder': {
+        'extension_supported': 'extensions',
+        'tenant_quota_get': 'quotas',
+        'default_quota_get': 'quotas',
+    },
+}
+
+# module: {function that changes quotas: functions it invalidates}
+INVALIDATES = {
+    'openstack_dashboard.api.nova': {
+        'tenant_quota_update': ('tenant_quota_get',),
+        'default_quota_update': ('default_quota_get', 'tenant_quota_get'),
+    },
+    'openstack_dashboard.api.neutron': {
+        'tenant_quota_update': ('tenant_quota_get',),
+    },
+    'openstack_dashboard.api.cinder': {
+        'tenant_quota_update': ('tenant_quota_get',),
+        'default_quota_update': ('default_quota_get', 'tenant_quota_get'),
+    },
+}
+
+TTLS = getattr(settings, 'SNAP_API_CACHE_TTLS',
+               {'extensions': 600, 'quotas': 60})
+
+
+def _generation(module, name):
+    """Bumped to invalidate every cached result of one function."""
+    return cache.get('snap-api-gen:{}.{}'.format(module, name), 0)
+
+
+def _key(module, name, args, kwargs):
+    # The request only matters through the arguments after it.
+    args = [a for a in args if not isinstance(a, HttpRequest)]
+    raw = repr((module, name, _generation(module, name), args,
+                sorted(kwargs.items())))
+    return 'snap-api:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _cached(module, name, fn, ttl):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = _key(module, name, args, kwargs)
+        result = cache.get(key)
+        if result is not None:
+            return result
+        result = fn(*args, **kwargs)
+        try:
+            cache.set(key, result, ttl)
+        except Exception:
+            LOG.debug('Not caching unpicklable result of %s.%s',
+                      module, name)
+        return result
+    return wrapper
+
+
+def _invalidating(module, targets, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            for target in targets:
+                key = 'snap-api-gen:{}.{}'.format(module, target)
+                cache.set(key, _generation(module, target) + 1, None)
+    return wrapper
+
+
+def install():
+    for module_name, functions in CACHED.items():
+        module = importlib.import_module(module_name)
+        for name, ttl in functions.items():
+            setattr(module, name, _cached(
+                module_name, name, getattr(module, name), TTLS[ttl]))
+    for module_name, functions in INVALIDATES.items():
+        module = importlib.import_module(module_name)
+        for name, targets in functions.items():
+            setattr(module, name, _invalidating(
+                module_name, targets, getattr(module, name)))
+
+
+class ApiCacheMiddleware(object):
+    """Installs the caching wrappers once Django is fully loaded.
+
+    Middleware is instantiated after the apps are ready, which makes it
+    a safe place to import and patch the API modules.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        return self.get_response(request)
@@ -0,0 +1,212 @@
+# Memoize Horizon's API lookups within a request, and start the ones a
+# page is known to make all at once.
+#
+# A page asks nova, neutron, glance and cinder for what it shows one
+# call after another, and its tables, tabs and quota checks ask for the
+# same flavors, images and networks again. Here the lookups in MEMOIZED
+# are remembered for the rest of the request they were made with, keyed
+# on their arguments, so that a repeat is answered at once. For the
+# pages in PREFETCH, the lookups they start with are submitted to a
+# thread pool as the request comes in; when the view gets to them, it
+# waits for the result that is already on its way instead of asking.
+#
+# Only GET requests are memoized, so that nothing a form changes is
+# answered from before the change. A prefetch that fails is made again
+# by the view, which then sees the error the way it always did. Each
+# response says what the lookups came to in an X-Snap-Api header:
+# "calls=12 memoized=3 prefetched=4 unused=0" (tests/horizon-latency.sh
+# shows it), where "unused" are prefetches the view didn't make, whose
+# arguments in PREFETCH no longer match the view's.
+
+import functools
+import importlib
+import logging
+import threading
+
+import futurist
+from django.conf import settings
+from django.http import HttpRequest
+
+LOG = logging.getLogger(__name__)
+
+NOVA = 'openstack_dashboard.api.nova'
+NEUTRON = 'openstack_dashboard.api.neutron'
+GLANCE = 'openstack_dashboard.api.glance'
+CINDER = 'openstack_dashboard.api.cinder'
+
+# module: functions that only read, and take the request first.
+MEMOIZED = {
+    NOVA: ('flavor_list', 'flavor_get', 'server_list', 'server_get',
+           'tenant_absolute_limits', 'availability_zone_list',
+           'keypair_list', 'hypervisor_list', 'service_list'),
+    NEUTRON: ('network_list', 'network_list_for_tenant', 'network_get',
+              'subnet_list', 'port_list', 'router_list',
+              'tenant_floating_ip_list', 'floating_ip_pools_list',
+              'security_group_list'),
+    GLANCE: ('image_list_detailed', 'image_get'),
+    CINDER: ('volume_list', 'volume_get', 'volume_snapshot_list',
+             'tenant_absolute_limits'),
+}
+
+
+def _instances(request):
+    return [
+        (NOVA, 'flavor_list', (request,), {}),
+        (GLANCE, 'image_list_detailed', (request,), {}),
+        (CINDER, 'volume_list', (request,), {}),
+    ]
+
+
+def _network_topology(request):
+    project_id = request.user.project_id
+    return [
+        (NOVA, 'server_list', (request,), {}),
+        (NEUTRON, 'network_list_for_tenant', (request, project_id),
+         {'include_external': True}),
+        (NEUTRON, 'router_list', (request,), {'tenant_id': project_id}),
+        (NEUTRON, 'port_list', (request,), {}),
+    ]
+
+
+# path: the calls the page makes before anything else, as
+# (module, function, args, kwargs).
+PREFETCH = {
+    '/project/instances/': _instances,
+    '/project/network_topology/json/': _network_topology,
+}
+
+WORKERS = getattr(settings, 'SNAP_API_FANOUT_WORKERS', 8)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = futurist.ThreadPoolExecutor(max_workers=WORKERS)
+        return _executor
+
+
+def _key(module, name, args, kwargs):
+    # The request only matters through the arguments after it.
+    args = [a for a in args if not isinstance(a, HttpRequest)]
+    return repr((module, name, args, sorted(kwargs.items())))
+
+
+def _state(args):
+    """Return the memo of the request among args, if there is one."""
+    for arg in args:
+        if isinstance(arg, HttpRequest):
+            return getattr(arg, '_snap_api', None)
+    return None
+
+
+class _Memo(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key: [future, prefetched, used]
+        self.results = {}
+        self.counts = {'calls': 0, 'memoized': 0, 'prefetched': 0}
+
+    def header(self):
+        unused = sum(1 for _, prefetched, used in self.results.values()
+                     if prefetched and not used)
+        return 'calls={calls} memoized={memoized} prefetched={prefetched} ' \
+               'unused={}'.format(unused, **self.counts)
+
+
+def _memoized(module, name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        memo = _state(args)
+        if memo is None:
+            return fn(*args, **kwargs)
+        key = _key(module, name, args, kwargs)
+        with memo.lock:
+            entry = memo.results.get(key)
+            if entry is None:
+                entry = memo.results[key] = [futurist.Future(), False, True]
+                memo.counts['calls'] += 1
+                owner = True
+            else:
+                owner = False
+                memo.counts['prefetched' if entry[1] and not entry[2]
+                            else 'memoized'] += 1
+                entry[2] = True
+        if not owner:
+            try:
+                return entry[0].result()
+            except Exception:
+                if not entry[1]:
+                    raise
+                LOG.debug('Prefetched %s.%s failed, asking again',
+                          module, name)
+                return fn(*args, **kwargs)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            # Not remembered: the next caller asks again.
+            with memo.lock:
+                memo.results.pop(key, None)
+            entry[0].set_exception(e)
+            raise
+        entry[0].set_result(result)
+        return result
+    return wrapper
+
+
+def _prefetch(memo, calls):
+    for module_name, name, args, kwargs in calls:
+        fn = getattr(importlib.import_module(module_name), name, None)
+        original = getattr(fn, '_snap_original', None)
+        if original is None:
+            continue
+        key = _key(module_name, name, args, kwargs)
+        with memo.lock:
+            if key in memo.results:
+                continue
+            memo.counts['calls'] += 1
+            memo.results[key] = [
+                _pool().submit(original, *args, **kwargs), True, False]
+
+
+def install():
+    for module_name, names in MEMOIZED.items():
+        module = importlib.import_module(module_name)
+        for name in names:
+            fn = getattr(module, name, None)
+            if fn is None:
+                LOG.debug('No %s.%s to memoize', module_name, name)
+                continue
+            wrapper = _memoized(module_name, name, fn)
+            wrapper._snap_original = fn
+            setattr(module, name, wrapper)
+
+
+class ApiFanoutMiddleware(object):
+    """Memoizes the API lookups of each GET, and starts its prefetches.
+
+    Installs the wrappers once Django is fully loaded, as
+    snap_cache.ApiCacheMiddleware does.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return self.get_response(request)
+        memo = request._snap_api = _Memo()
+        calls = PREFETCH.get(request.path)
+        if calls and request.user.is_authenticated:
+            try:
+                _prefetch(memo, calls(request))
+            except Exception:
+                LOG.exception('Could not prefetch for %s', request.path)
+        response = self.get_response(request)
+        response['X-Snap-Api'] = memo.header()
+        return response
@@ -0,0 +1,20 @@
+# Write Horizon's log records as JSON objects, one per line, with
+# "snap set microstack logformat=json", as the oslo.log services do.
+
+import json
+import logging
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'asctime': self.formatTime(record),
+            'process': record.process,
+            'levelname': record.levelname,
+            'name': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
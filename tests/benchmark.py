@@ -0,0 +1,806 @@
+#!/usr/bin/env python3
+##############################################################################
+#
+# Performance benchmarks for Microstack. Run on a machine with microstack
+# installed (e.g. a multipass vm, see basic-test.sh); nothing is fetched
+# from the Internet. Only the python3 standard library is needed, so that
+# the same script can measure any snap revision.
+#
+#   sudo tests/benchmark.py run -o results.json
+#
+# measures the APIs, networking, booting and memory use of the installed
+# snap, and how long 50 boot requests sent at once take to be scheduled
+# (compare runs with "snap set microstack schedulerprofile=single|general").
+# 50 clients at once then validate tokens and fetch the version discovery
+# documents of keystone and placement through nginx, which times them and
+# counts the 502s and other 5xx responses (compare runs with
+# "snap set microstack nginxmicrocache=true|false", or other sizings).
+# It also records how many bytes of logs the API calls write; comparing
+# runs with "snap set microstack loglevel.nova=debug|info|warning" (and
+# keystone, neutron, glance), or logformat=text|json, shows what logging
+# costs the API latencies.
+#
+#   sudo tests/benchmark.py run --snap microstack_rocky_amd64.snap
+#
+# also removes microstack, and times installing the given snap until the
+# APIs answer, and a re-run of the configure hook.
+#
+#   sudo tests/benchmark.py run --image-sizes 1,10
+#
+# also times the first boot of a 1GB and a 10GB image, which Nova has to
+# fetch from Glance into its image cache first. Needs twice the disk.
+#
+#   tests/benchmark.py compare baseline.json results.json
+#
+# lists every measurement that got slower (or bigger) by more than the
+# threshold, and exits 1 if there are any. Comparing a run with each
+# networking backend ("snap set microstack networkbackend=ovs|ovn") shows
+# how they differ in port create to ACTIVE times and RabbitMQ traffic.
+#
+##############################################################################
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from concurrent import futures
+from urllib import error
+from urllib import request
+
+SNAP_COMMON = '/var/snap/microstack/common'
+SNAP_BIN = '/snap/bin'
+RC = os.path.join(SNAP_COMMON, 'etc/microstack.rc')
+GATEWAY = '10.20.20.1'
+
+# Answered without a token once the service is up.
+DISCOVERY = {
+    'keystone': 'http://{}:5000/v3',
+    'nova': 'http://{}:8774/',
+    'placement': 'http://{}:8778/',
+    'neutron': 'http://{}:9696/',
+    'glance': 'http://{}:9292/',
+    'horizon': 'http://{}/',
+}
+
+# Measurements that aren't durations or sizes, and aren't compared.
+NOT_COMPARED = ('meta', 'samples', 'instances', 'requests', 'failed',
+                'clients')
+# Counts that regress as soon as there are more of them.
+ERROR_COUNTS = ('responses_502', 'responses_5xx', 'connection_errors')
+
+
+class Response(object):
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+def call(method, url, body=None, headers=None, data=None, timeout=60):
+    headers = dict(headers or {})
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    req = request.Request(url, data=data, headers=headers, method=method)
+    with request.urlopen(req, timeout=timeout) as resp:
+        return Response(resp.status, resp.headers, resp.read())
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'samples': 0}
+
+    def at(p):
+        return round(samples[min(len(samples) - 1,
+                                 int(p / 100.0 * len(samples)))], 4)
+
+    return {
+        'samples': len(samples),
+        'p50': at(50),
+        'p90': at(90),
+        'p99': at(99),
+        'max': round(samples[-1], 4),
+        'mean': round(sum(samples) / len(samples), 4),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.monotonic()
+    result = fn(*args, **kwargs)
+    return time.monotonic() - start, result
+
+
+class Cloud(object):
+    """Just enough of the OpenStack APIs, over one token."""
+
+    def __init__(self, rc=RC):
+        self.env = {}
+        with open(rc) as f:
+            for line in f:
+                if line.startswith('export '):
+                    key, _, value = line[len('export '):].strip().partition(
+                        '=')
+                    self.env[key] = value
+        self.auth_url = self.env['OS_AUTH_URL'].rstrip('/') + '/v3'
+        self.token, body = self.issue()
+        self.project_id = body['token']['project']['id']
+        self.endpoints = {}
+        for service in body['token']['catalog']:
+            for endpoint in service['endpoints']:
+                if endpoint['interface'] == 'public':
+                    self.endpoints[service['type']] = endpoint['url']
+
+    def issue(self):
+        """Issue a token, and return it with the token document."""
+        resp = call('POST', self.auth_url + '/auth/tokens', {'auth': {
+            'identity': {'methods': ['password'], 'password': {'user': {
+                'name': self.env['OS_USERNAME'],
+                'domain': {'name': self.env['OS_USER_DOMAIN_NAME']},
+                'password': self.env['OS_PASSWORD']}}},
+            'scope': {'project': {
+                'name': self.env['OS_PROJECT_NAME'],
+                'domain': {'name': self.env['OS_PROJECT_DOMAIN_NAME']}}},
+        }})
+        return resp.headers['X-Subject-Token'], resp.json()
+
+    def __call__(self, method, service, path, body=None, headers=None,
+                 **kwargs):
+        headers = dict(headers or {})
+        headers['X-Auth-Token'] = self.token
+        return call(method, self.endpoints[service].rstrip('/') + path,
+                    body, headers, **kwargs)
+
+    def find(self, service, path, key, name):
+        found = self('GET', service, path).json()[key]
+        found = [r for r in found if r.get('name') == name]
+        return found[0]['id'] if found else None
+
+
+def wait_for_apis(host, deadline):
+    """Return when every API answers, or raise at the deadline."""
+    waiting = dict((name, url.format(host)) for name, url in DISCOVERY.items())
+    while waiting:
+        for name, url in list(waiting.items()):
+            try:
+                call('GET', url, timeout=5)
+            except error.HTTPError as e:
+                if e.code < 500:
+                    del waiting[name]
+            except (error.URLError, socket.error):
+                pass
+            else:
+                del waiting[name]
+        if waiting and time.monotonic() > deadline:
+            raise RuntimeError('Not ready: ' + ', '.join(sorted(waiting)))
+        time.sleep(0.5)
+
+
+def install(snap, host):
+    """Time a fresh install, and a re-run of the configure hook."""
+    subprocess.call(['snap', 'remove', 'microstack'])
+    start = time.monotonic()
+    subprocess.check_call(['snap', 'install', '--classic', '--dangerous',
+                           snap])
+    installed = time.monotonic() - start
+    wait_for_apis(host, start + 1800)
+    ready = time.monotonic() - start
+
+    dns = subprocess.check_output(
+        ['snap', 'get', 'microstack', 'dns']).decode().strip()
+    configure, _ = timed(subprocess.check_call,
+                         ['snap', 'set', 'microstack', 'dns=' + dns])
+    return {
+        'install_seconds': round(installed, 2),
+        'install_to_ready_seconds': round(ready, 2),
+        'configure_seconds': round(configure, 2),
+    }
+
+
+def api_latencies(cloud, iterations):
+    """Time each of the API calls, iterations times."""
+    samples = dict((name, []) for name in [
+        'keystone_token_issue', 'keystone_token_validate',
+        'nova_server_list', 'placement_allocation_candidates',
+        'neutron_port_create', 'glance_image_upload'])
+    network = cloud.find('network', '/v2.0/networks?name=test',
+                         'networks', 'test')
+    blob = os.urandom(4 * 1024 * 1024)
+
+    for _ in range(iterations):
+        seconds, (token, _) = timed(cloud.issue)
+        samples['keystone_token_issue'].append(seconds)
+
+        samples['keystone_token_validate'].append(timed(
+            call, 'GET', cloud.auth_url + '/auth/tokens',
+            headers={'X-Auth-Token': cloud.token,
+                     'X-Subject-Token': token})[0])
+
+        samples['nova_server_list'].append(timed(
+            cloud, 'GET', 'compute', '/servers')[0])
+
+        samples['placement_allocation_candidates'].append(timed(
+            cloud, 'GET', 'placement',
+            '/allocation_candidates?resources=VCPU:1,MEMORY_MB:512,DISK_GB:1',
+            headers={'OpenStack-API-Version': 'placement 1.10'})[0])
+
+        if network:
+            seconds, resp = timed(cloud, 'POST', 'network', '/v2.0/ports',
+                                  {'port': {'network_id': network}})
+            samples['neutron_port_create'].append(seconds)
+            cloud('DELETE', 'network',
+                  '/v2.0/ports/' + resp.json()['port']['id'])
+
+        # Creating the record and uploading the data.
+        start = time.monotonic()
+        image = cloud('POST', 'image', '/v2/images', {
+            'name': 'benchmark-' + uuid.uuid4().hex[:8],
+            'disk_format': 'raw', 'container_format': 'bare'}).json()
+        cloud('PUT', 'image', '/v2/images/{}/file'.format(image['id']),
+              data=blob,
+              headers={'Content-Type': 'application/octet-stream'})
+        samples['glance_image_upload'].append(time.monotonic() - start)
+        cloud('DELETE', 'image', '/v2/images/' + image['id'])
+
+    return dict((name, percentiles(s)) for name, s in samples.items())
+
+
+def concurrent_load(cloud, host, clients, per_client):
+    """Have clients at once make requests through nginx, and time them.
+
+    Each client validates a token and fetches the keystone and placement
+    version discovery documents in turn, per_client requests in all.
+    """
+    targets = [
+        ('keystone_token_validate', cloud.auth_url + '/auth/tokens',
+         {'X-Auth-Token': cloud.token, 'X-Subject-Token': cloud.token}),
+        ('keystone_discovery', DISCOVERY['keystone'].format(host), {}),
+        ('placement_discovery', DISCOVERY['placement'].format(host), {}),
+    ]
+
+    def client(n):
+        done = []
+        for i in range(per_client):
+            name, url, headers = targets[(n + i) % len(targets)]
+            start = time.monotonic()
+            try:
+                status = call('GET', url, headers=headers, timeout=60).status
+            except error.HTTPError as e:
+                status = e.code
+            except (error.URLError, socket.error):
+                status = None
+            done.append((name, time.monotonic() - start, status))
+        return done
+
+    with futures.ThreadPoolExecutor(max_workers=clients) as pool:
+        done = [request for requests in pool.map(client, range(clients))
+                for request in requests]
+    result = dict((name, percentiles([s for n, s, _ in done if n == name]))
+                  for name, _, _ in targets)
+    result.update({
+        'clients': clients,
+        'requests': len(done),
+        'all': percentiles([seconds for _, seconds, _ in done]),
+        'responses_502': len([1 for _, _, status in done if status == 502]),
+        'responses_5xx': len([1 for _, _, status in done
+                              if status and status >= 500]),
+        'connection_errors': len([1 for _, _, status in done
+                                  if status is None]),
+    })
+    return result
+
+
+def log_bytes():
+    """Size of the logs, and of the last one rotated from each."""
+    log_dir = os.path.join(SNAP_COMMON, 'log')
+    total = 0
+    for name in os.listdir(log_dir):
+        if name.endswith(('.log', '.log.1')):
+            total += os.path.getsize(os.path.join(log_dir, name))
+    return total
+
+
+def logged(fn, *args):
+    """Call fn, and return its result and the log bytes it wrote."""
+    before = log_bytes()
+    result = fn(*args)
+    return result, log_bytes() - before
+
+
+def broker_received():
+    """Frames RabbitMQ has received, over all its connections."""
+    out = subprocess.check_output(
+        [os.path.join(SNAP_BIN, 'microstack.rabbitmqctl'), '-q',
+         'list_connections', 'recv_cnt'], universal_newlines=True)
+    return sum(int(line) for line in out.split() if line.isdigit())
+
+
+def broker_rate(fn, *args):
+    """Call fn, and return its result and RabbitMQ's receive rate."""
+    before = broker_received()
+    seconds, result = timed(fn, *args)
+    return result, round((broker_received() - before) / seconds, 1)
+
+
+def ovs_vsctl(*args):
+    subprocess.check_call(
+        [os.path.join(SNAP_BIN, 'microstack.ovs-vsctl')] + list(args))
+
+
+def port_to_active(cloud, network, timeout=60):
+    """Create a port bound to this host, plug it, and time it to ACTIVE.
+
+    The port is plugged into br-int the way nova plugs an instance's,
+    with an internal interface standing in for the tap device.
+    """
+    start = time.monotonic()
+    port = cloud('POST', 'network', '/v2.0/ports', {'port': {
+        'network_id': network, 'device_owner': 'compute:benchmark',
+        'device_id': str(uuid.uuid4()),
+        'binding:host_id': socket.gethostname()}}).json()['port']
+    tap = 'tap' + port['id'][:11]
+    try:
+        ovs_vsctl('--', '--may-exist', 'add-port', 'br-int', tap,
+                  '--', 'set', 'Interface', tap, 'type=internal',
+                  'external-ids:iface-id=' + port['id'],
+                  'external-ids:attached-mac=' + port['mac_address'],
+                  'external-ids:iface-status=active')
+        while True:
+            status = cloud('GET', 'network', '/v2.0/ports/' + port['id']
+                           ).json()['port']['status']
+            if status == 'ACTIVE':
+                return time.monotonic() - start
+            if time.monotonic() - start > timeout:
+                return None
+            time.sleep(0.1)
+    finally:
+        ovs_vsctl('--', '--if-exists', 'del-port', 'br-int', tap)
+        cloud('DELETE', 'network', '/v2.0/ports/' + port['id'])
+
+
+def networking(cloud, iterations, idle=30):
+    """Port create to ACTIVE times, and RabbitMQ traffic."""
+    network = cloud.find('network', '/v2.0/networks?name=test',
+                         'networks', 'test')
+    if not network:
+        return {'skipped': 'missing network'}
+
+    def sample():
+        # A port that couldn't be made or plugged counts as failed, as
+        # one that didn't go ACTIVE does.
+        try:
+            return port_to_active(cloud, network)
+        except Exception:
+            return None
+
+    _, idle_rate = broker_rate(time.sleep, idle)
+    samples, ports_rate = broker_rate(
+        lambda: [sample() for _ in range(iterations)])
+    return {
+        'failed': len([s for s in samples if s is None]),
+        'port_to_active': percentiles([s for s in samples if s is not None]),
+        'broker_frames_per_second_idle': idle_rate,
+        'broker_frames_per_second_ports': ports_rate,
+    }
+
+
+def ssh_banner(ip, deadline):
+    """Wait until sshd on ip says hello."""
+    while time.monotonic() < deadline:
+        try:
+            sock = socket.create_connection((ip, 22), timeout=2)
+            try:
+                if sock.recv(4).startswith(b'SSH-'):
+                    return
+            finally:
+                sock.close()
+        except (socket.error, socket.timeout):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('No ssh on {}'.format(ip))
+
+
+def boot_one(cloud, name, ids, timeout, ssh=True):
+    start = time.monotonic()
+    deadline = start + timeout
+    seconds, resp = timed(cloud, 'POST', 'compute', '/servers', {'server': {
+        'name': name, 'flavorRef': ids['flavor'], 'imageRef': ids['image'],
+        'networks': [{'uuid': ids['network']}]}})
+    server_id = resp.json()['server']['id']
+    result = {'id': server_id, 'create': seconds}
+    try:
+        while True:
+            server = cloud('GET', 'compute',
+                           '/servers/' + server_id).json()['server']
+            if server['status'] == 'ACTIVE':
+                break
+            if server['status'] == 'ERROR' or time.monotonic() > deadline:
+                raise RuntimeError('{} is {}'.format(name, server['status']))
+            time.sleep(0.5)
+        result['active'] = time.monotonic() - start
+        if not ssh:
+            return result
+
+        port = cloud('GET', 'network', '/v2.0/ports?device_id=' +
+                     server_id).json()['ports'][0]
+        fip = cloud('POST', 'network', '/v2.0/floatingips', {'floatingip': {
+            'floating_network_id': ids['external'],
+            'port_id': port['id']}}).json()['floatingip']
+        result['fip'] = fip['id']
+        ssh_banner(fip['floating_ip_address'], deadline)
+        result['ssh'] = time.monotonic() - start
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def boot(cloud, instances, timeout):
+    """Boot cirros instances all at once, and time them to ACTIVE and ssh."""
+    ids = {
+        'flavor': cloud.find('compute', '/flavors', 'flavors', 'm1.tiny'),
+        'image': cloud.find('image', '/v2/images?name=cirros', 'images',
+                            'cirros'),
+        'network': cloud.find('network', '/v2.0/networks?name=test',
+                              'networks', 'test'),
+        'external': cloud.find('network', '/v2.0/networks?name=external',
+                               'networks', 'external'),
+    }
+    missing = [key for key, value in ids.items() if not value]
+    if missing:
+        return {'skipped': 'missing ' + ', '.join(sorted(missing))}
+    allow_ssh(cloud)
+
+    names = ['benchmark-{}'.format(i) for i in range(instances)]
+    with futures.ThreadPoolExecutor(max_workers=instances) as pool:
+        results = list(pool.map(
+            lambda name: boot_one(cloud, name, ids, timeout), names))
+
+    for result in results:
+        if 'fip' in result:
+            cloud('DELETE', 'network', '/v2.0/floatingips/' + result['fip'])
+        cloud('DELETE', 'compute', '/servers/' + result['id'])
+
+    return {
+        'instances': instances,
+        'failed': len([r for r in results if 'error' in r]),
+        'create_api': percentiles([r['create'] for r in results]),
+        'boot_to_active': percentiles(
+            [r['active'] for r in results if 'active' in r]),
+        'boot_to_ssh': percentiles([r['ssh'] for r in results if 'ssh' in r]),
+    }
+
+
+def upload_image(cloud, name, size):
+    """Upload a blank raw image of size bytes."""
+    image = cloud('POST', 'image', '/v2/images', {
+        'name': name, 'disk_format': 'raw',
+        'container_format': 'bare'}).json()
+    with open('/dev/zero', 'rb') as zero:
+        data = Limited(zero, size)
+        cloud('PUT', 'image', '/v2/images/{}/file'.format(image['id']),
+              data=data, timeout=600,
+              headers={'Content-Type': 'application/octet-stream',
+                       'Content-Length': str(size)})
+    return image['id']
+
+
+class Limited(object):
+    """The first size bytes of a file, read in chunks."""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.left = size
+
+    def read(self, n=-1):
+        if n < 0 or n > self.left:
+            n = self.left
+        n = min(n, 1024 * 1024)
+        self.left -= n
+        return self.f.read(n) if n else b''
+
+
+def first_boot(cloud, sizes, timeout):
+    """Time the first boot of images of each size (in GB) to ACTIVE.
+
+    Nothing boots from a blank image, but the time to ACTIVE is what
+    Nova takes to fetch the image into its cache and start the domain,
+    which is what's measured.
+    """
+    ids = {
+        'network': cloud.find('network', '/v2.0/networks?name=test',
+                              'networks', 'test'),
+    }
+    if not ids['network']:
+        return {'skipped': 'missing network'}
+
+    results = {}
+    for size in sizes:
+        name = 'benchmark-{}gb-{}'.format(size, uuid.uuid4().hex[:8])
+        upload, ids['image'] = timed(upload_image, cloud, name,
+                                     size * 1024 ** 3)
+        ids['flavor'] = cloud('POST', 'compute', '/flavors', {'flavor': {
+            'name': name, 'ram': 256, 'vcpus': 1,
+            'disk': size + 1}}).json()['flavor']['id']
+        try:
+            result = boot_one(cloud, name, ids, timeout, ssh=False)
+            cloud('DELETE', 'compute', '/servers/' + result['id'])
+        finally:
+            cloud('DELETE', 'compute', '/flavors/' + ids['flavor'])
+            cloud('DELETE', 'image', '/v2/images/' + ids['image'])
+        results['{}gb'.format(size)] = dict(
+            (key, round(value, 2)) for key, value in [
+                ('upload_seconds', upload),
+                ('boot_to_active_seconds', result.get('active')),
+            ] if value is not None)
+        if 'error' in result:
+            results['{}gb'.format(size)]['failed'] = 1
+    return results
+
+
+def raise_quota(cloud, **wanted):
+    """Raise the project's compute quotas to at least wanted.
+
+    Returns the quotas as they were, for restore_quota.
+    """
+    path = '/os-quota-sets/' + cloud.project_id
+    quotas = cloud('GET', 'compute', path).json()['quota_set']
+    old = dict((key, quotas[key]) for key in wanted)
+    raised = dict((key, value) for key, value in wanted.items()
+                  if 0 <= old[key] < value)
+    if raised:
+        cloud('PUT', 'compute', path, {'quota_set': raised})
+    return old
+
+
+def restore_quota(cloud, old):
+    # Forced, as the instances may not all be gone yet.
+    quota_set = dict(old, force=True)
+    cloud('PUT', 'compute', '/os-quota-sets/' + cloud.project_id,
+          {'quota_set': quota_set})
+
+
+def scheduling(cloud, requests, timeout=300):
+    """Time boot requests, all sent at once, until a host is picked.
+
+    An instance has been scheduled once it has a host, or is in ERROR
+    (e.g. NoValidHost). The instances are deleted as soon as they are.
+    The project's quotas are raised for the run, so that they don't
+    turn requests away; any that are turned away count as failed.
+    """
+    ids = {
+        'image': cloud.find('image', '/v2/images?name=cirros', 'images',
+                            'cirros'),
+        'network': cloud.find('network', '/v2.0/networks?name=test',
+                              'networks', 'test'),
+    }
+    if not all(ids.values()):
+        return {'skipped': 'missing image or network'}
+    prefix = 'benchmark-schedule-{}-'.format(uuid.uuid4().hex[:8])
+    # As small as will boot, so that the host has room for all of them.
+    ram = 64
+    ids['flavor'] = cloud('POST', 'compute', '/flavors', {'flavor': {
+        'name': prefix + 'flavor', 'ram': ram, 'vcpus': 1,
+        'disk': 1}}).json()['flavor']['id']
+    # server id: when its request was sent
+    sent = {}
+    refused = []
+
+    def create(i):
+        start = time.monotonic()
+        try:
+            resp = cloud('POST', 'compute', '/servers', {'server': {
+                'name': prefix + str(i), 'flavorRef': ids['flavor'],
+                'imageRef': ids['image'],
+                'networks': [{'uuid': ids['network']}]}})
+        except error.HTTPError as e:
+            refused.append(e.code)
+            return
+        sent[resp.json()['server']['id']] = start
+
+    latencies, failed = [], 0
+    quotas = None
+    try:
+        quotas = raise_quota(cloud, instances=requests, cores=requests,
+                             ram=ram * requests)
+        with futures.ThreadPoolExecutor(max_workers=requests) as pool:
+            list(pool.map(create, range(requests)))
+        deadline = time.monotonic() + timeout
+        while sent and time.monotonic() < deadline:
+            servers = cloud('GET', 'compute', '/servers/detail?name=^' +
+                            prefix).json()['servers']
+            now = time.monotonic()
+            for server in servers:
+                if server['id'] not in sent:
+                    continue
+                if server['status'] == 'ERROR':
+                    failed += 1
+                elif not server.get('OS-EXT-SRV-ATTR:host'):
+                    continue
+                else:
+                    latencies.append(now - sent[server['id']])
+                cloud('DELETE', 'compute', '/servers/' + server['id'])
+                del sent[server['id']]
+            time.sleep(0.2)
+    finally:
+        for server_id in sent:
+            cloud('DELETE', 'compute', '/servers/' + server_id)
+        cloud('DELETE', 'compute', '/flavors/' + ids['flavor'])
+        if quotas:
+            restore_quota(cloud, quotas)
+
+    result = percentiles(latencies)
+    result.update(requests=requests,
+                  failed=failed + len(sent) + len(refused))
+    return result
+
+
+def allow_ssh(cloud):
+    groups = cloud('GET', 'network', '/v2.0/security-groups?name=default&'
+                   'project_id=' + cloud.project_id).json()['security_groups']
+    rules = groups[0]['security_group_rules']
+    if not [r for r in rules if r['direction'] == 'ingress' and
+            r['protocol'] == 'tcp' and
+            (r['port_range_min'] or 0) <= 22 <= (r['port_range_max'] or 65535)]:
+        cloud('POST', 'network', '/v2.0/security-group-rules', {
+            'security_group_rule': {
+                'security_group_id': groups[0]['id'], 'direction': 'ingress',
+                'protocol': 'tcp', 'port_range_min': 22,
+                'port_range_max': 22}})
+
+
+def rss_mb():
+    """Total resident memory of the processes running from the snap."""
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+                if b'/snap/microstack/' not in f.read():
+                    continue
+            with open('/proc/{}/status'.format(pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except (IOError, OSError):
+            continue
+    return round(total / 1024.0, 1)
+
+
+def meta():
+    cpus = os.cpu_count()
+    with open('/proc/meminfo') as f:
+        memory = int(f.readline().split()[1]) // 1024
+    try:
+        revision = os.readlink('/snap/microstack/current')
+    except OSError:
+        revision = None
+    return {'revision': revision, 'cpus': cpus, 'memory_mb': memory,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+def run(args):
+    results = {}
+    if args.snap:
+        results['install'] = install(args.snap, args.host)
+    results['meta'] = meta()
+    cloud = Cloud()
+    results['api'], written = logged(api_latencies, cloud, args.iterations)
+    results['log_bytes_per_iteration'] = written // args.iterations
+    results['networking'] = networking(cloud, args.ports)
+    results['boot'] = boot(cloud, args.instances, args.timeout)
+    results['scheduling'] = scheduling(cloud, args.schedule_requests)
+    results['concurrency'] = concurrent_load(cloud, args.host, args.clients,
+                                             args.client_requests)
+    if args.image_sizes:
+        results['first_boot'] = first_boot(
+            cloud, [int(size) for size in args.image_sizes.split(',')],
+            args.timeout)
+    results['rss_mb'] = rss_mb()
+
+    out = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    print(out)
+    return 0
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if key in NOT_COMPARED:
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f))
+    with open(args.current) as f:
+        current = flatten(json.load(f))
+
+    regressions = 0
+    print('{:<52} {:>10} {:>10} {:>8}'.format(
+        'measurement', 'baseline', 'current', 'change'))
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key], current[key]
+        change = (new - old) / old if old else 0.0
+        if key.rsplit('.', 1)[-1] in ERROR_COUNTS:
+            regressed = new > old
+        else:
+            # Small absolute differences are noise, whatever the ratio.
+            regressed = change > args.threshold and new - old > args.noise
+        regressions += regressed
+        print('{:<52} {:>10} {:>10} {:>+7.0%}{}'.format(
+            key, old, new, change, '  REGRESSION' if regressed else ''))
+    for key in sorted(set(baseline) ^ set(current)):
+        print('{:<52} only in {}'.format(
+            key, 'baseline' if key in baseline else 'current'))
+    print('{} regression(s)'.format(regressions))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark microstack.')
+    actions = parser.add_subparsers(dest='action')
+
+    run_parser = actions.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='write the JSON here too')
+    run_parser.add_argument('--snap', help='reinstall microstack from this '
+                            'snap first, timing the install and configure')
+    run_parser.add_argument('--host', default=GATEWAY)
+    run_parser.add_argument('--iterations', type=int, default=50,
+                            help='times to make each API call')
+    run_parser.add_argument('--ports', type=int, default=20,
+                            help='ports to time from create to ACTIVE')
+    run_parser.add_argument('--instances', type=int, default=4,
+                            help='instances to boot at once')
+    run_parser.add_argument('--schedule-requests', type=int, default=50,
+                            help='boot requests to send at once, to time '
+                                 'scheduling')
+    run_parser.add_argument('--clients', type=int, default=50,
+                            help='clients making requests through nginx at '
+                                 'once')
+    run_parser.add_argument('--client-requests', type=int, default=20,
+                            help='requests each of those clients makes')
+    run_parser.add_argument('--timeout', type=int, default=600,
+                            help='seconds each instance gets to boot')
+    run_parser.add_argument('--image-sizes', metavar='GB,GB',
+                            help='time the first boot of images of these '
+                                 'sizes in GB, e.g. 1,10')
+
+    compare_parser = actions.add_parser(
+        'compare', help='compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='slowdown that counts as a regression '
+                                     '(default 0.1, i.e. 10%%)')
+    compare_parser.add_argument('--noise', type=float, default=0.005,
+                                help='differences smaller than this are '
+                                     'ignored (default 0.005)')
+
+    args = parser.parse_args()
+    if args.action == 'run':
+        return run(args)
+    if args.action == 'compare':
+        return compare(args)
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
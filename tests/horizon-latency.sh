@@ -0,0 +1,63 @@
+#!/bin/bash
+##############################################################################
+#
+# Times how long the dashboard takes to render a handful of pages, as the
+# admin user. Run it on a host with microstack installed.
+#
+# To compare Horizon's caching backends, run it once with each:
+#
+#   sudo snap set microstack horizoncache=locmem
+#   sudo systemctl restart snap.microstack.horizon-uwsgi
+#   tests/horizon-latency.sh
+#   sudo snap set microstack horizoncache=memcached
+#   sudo systemctl restart snap.microstack.horizon-uwsgi
+#   tests/horizon-latency.sh
+#
+# and likewise with horizonfanout=false and true, to see what making a
+# page's API calls at once, and each only once, saves. The api column
+# shows the X-Snap-Api header of the last request to each page: the
+# calls made, and those answered from the request's memo or from a
+# prefetch.
+#
+# The first request to each page is not counted, as it warms the caches.
+#
+# Accepts one optional argument: the number of times to load each page
+# (default 10).
+#
+##############################################################################
+
+set -e
+
+RUNS=${1:-10}
+HORIZON=http://10.20.20.1
+PASSWORD=${OS_PASSWORD:-$(sudo snap get microstack ospassword)}
+PAGES="/project/ /project/instances/ /project/images/ /project/network_topology/
+/project/network_topology/json/
+/project/api_access/ /admin/hypervisors/"
+
+JAR=$(mktemp)
+trap "rm -f $JAR" EXIT
+
+# Log in.
+curl -s -c $JAR -b $JAR $HORIZON/auth/login/ > /dev/null
+TOKEN=$(awk '$6 == "csrftoken" {print $7}' $JAR)
+curl -s -c $JAR -b $JAR -o /dev/null \
+     -d "csrfmiddlewaretoken=$TOKEN&region=default&username=admin" \
+     --data-urlencode "password=$PASSWORD" \
+     $HORIZON/auth/login/
+grep -q sessionid $JAR || { echo "Could not log in to $HORIZON"; exit 1; }
+
+printf "%-28s %8s %8s %8s  %s\n" page median mean max api
+for page in $PAGES; do
+    curl -s -b $JAR -o /dev/null $HORIZON$page
+    for run in $(seq $RUNS); do
+        curl -s -b $JAR -o /dev/null -w "%{time_total}\n" $HORIZON$page
+    done | sort -n | awk -v page=$page '
+        { t[NR] = $1; sum += $1 }
+        END { printf "%-28s %7.3fs %7.3fs %7.3fs  ",
+                     page, t[int((NR + 1) / 2)], sum / NR, t[NR] }'
+    curl -s -b $JAR -o /dev/null -D - $HORIZON$page \
+        | awk 'tolower($1) == "x-snap-api:" { $1 = ""; api = $0 }
+               END { sub(/^ /, "", api); sub(/\r$/, "", api);
+                     print api == "" ? "-" : api }'
+done
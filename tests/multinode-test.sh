@@ -0,0 +1,128 @@
+#!/bin/bash
+##############################################################################
+#
+# This is a multi node test script for Microstack. It installs the
+# microstack snap in two LXD containers on this machine, joins the
+# second to the first as a compute node (microstack.add-compute and
+# microstack.join), boots an instance on the compute node, and checks
+# that the controller reaches it over the tunnel between them.
+#
+# LXD and the petname debian package must be installed on the host
+# system, and /dev/kvm must be there, in order to run this test. The
+# containers are privileged, and load the kernel modules that
+# openvswitch and libvirt need from the host.
+#
+# -d <distro>  # Specifies the distro of the containers.
+#
+##############################################################################
+
+# Configuration and checks
+set -ex
+
+DISTRO=18.04
+
+while getopts d: option
+do
+    case "${option}"
+    in
+        d) DISTRO=${OPTARG};;
+    esac
+done
+
+command -v lxc > /dev/null || (echo "Please install LXD."; exit 1);
+command -v petname > /dev/null || (echo "Please install petname."; exit 1);
+if [ ! -f microstack_rocky_amd64.snap ]; then
+   echo "microstack_rocky_amd64.snap not found."
+   echo "Please run snapcraft before executing the tests."
+   exit 1
+fi
+
+CONTROLLER=$(petname)
+COMPUTE=$(petname)
+
+echo "++++++++++++++++++++++++++++++++++++++++++++++++++"
+echo "++    Starting tests on $CONTROLLER and $COMPUTE."
+echo "++      Distro: $DISTRO"
+echo "++++++++++++++++++++++++++++++++++++++++++++++++++"
+
+# Launch the nodes, and install the snap on each.
+for node in $CONTROLLER $COMPUTE; do
+    lxc launch ubuntu:$DISTRO $node \
+        -c security.privileged=true \
+        -c security.nesting=true \
+        -c linux.kernel_modules=openvswitch,nbd,ip_tables,ip6_tables,iptable_nat
+    lxc config device add $node kvm unix-char path=/dev/kvm
+    lxc exec $node -- cloud-init status --wait
+    lxc file push microstack_rocky_amd64.snap $node/root/
+    lxc exec $node -- snap install --classic --dangerous \
+        /root/microstack_rocky_amd64.snap
+done
+
+# Join the compute node. add-compute prints the join command, then
+# waits for the node to register and maps it into the cell.
+lxc exec $CONTROLLER -- /snap/bin/microstack.add-compute > add-compute.log &
+ADD_COMPUTE=$!
+until grep -q "microstack.join" add-compute.log; do
+    kill -0 $ADD_COMPUTE || { cat add-compute.log; exit 1; }
+    sleep 1
+done
+JOIN=$(grep "microstack.join" add-compute.log)
+lxc exec $COMPUTE -- $JOIN
+wait $ADD_COMPUTE
+cat add-compute.log
+
+# Only mapped hosts are scheduled to.
+ATTEMPTS=1
+MAX_ATTEMPTS=12
+until lxc exec $CONTROLLER -- /snap/bin/microstack.nova-manage \
+          cell_v2 list_hosts | grep -w $COMPUTE; do
+    ATTEMPTS=$(($ATTEMPTS + 1));
+    if test $ATTEMPTS -gt $MAX_ATTEMPTS; then
+        echo "$COMPUTE was not mapped into a cell!";
+        exit 1;
+    fi
+    sleep 5
+done;
+
+# Only the compute daemons run on the compute node.
+if lxc exec $COMPUTE -- systemctl is-active --quiet snap.microstack.nova-api; then
+    echo "The control plane is running on $COMPUTE!";
+    exit 1;
+fi
+
+# Boot an instance on the compute node.
+lxc exec $CONTROLLER -- /snap/bin/microstack.openstack server create \
+    --flavor m1.tiny --image cirros --network test \
+    --availability-zone nova:$COMPUTE --wait breakfast
+HOST=$(lxc exec $CONTROLLER -- /snap/bin/microstack.openstack server show \
+           breakfast -f value -c OS-EXT-SRV-ATTR:host)
+if [ "$HOST" != "$COMPUTE" ]; then
+    echo "breakfast is on $HOST, not $COMPUTE!";
+    exit 1;
+fi
+
+# The controller's dhcp namespace reaches the instance over the
+# tunnel.
+IP=$(lxc exec $CONTROLLER -- /snap/bin/microstack.openstack server show \
+         breakfast -f value -c addresses | cut -d= -f2)
+NETWORK=$(lxc exec $CONTROLLER -- /snap/bin/microstack.openstack network \
+              show test -f value -c id)
+echo "Waiting for ping..."
+PINGS=1
+MAX_PINGS=20
+until lxc exec $CONTROLLER -- ip netns exec qdhcp-$NETWORK \
+          ping -c 1 $IP &>/dev/null; do
+    PINGS=$(($PINGS + 1));
+    if test $PINGS -gt $MAX_PINGS; then
+        echo "Unable to ping breakfast from $CONTROLLER!";
+        exit 1;
+    fi
+    sleep 5
+done;
+
+# Cleanup
+echo "++++++++++++++++++++++++++++++++++++++++++++++++++"
+echo "++   Completed tests. Tearing down the nodes.   ++"
+echo "++++++++++++++++++++++++++++++++++++++++++++++++++"
+lxc delete --force $CONTROLLER $COMPUTE
+rm -f add-compute.log